@@ -1,14 +1,38 @@
-from fastapi import FastAPI, WebSocket, HTTPException, WebSocketDisconnect
+from fastapi import (
+    BackgroundTasks,
+    FastAPI,
+    WebSocket,
+    HTTPException,
+    WebSocketDisconnect,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import List, Dict, Optional, Union
 import uvicorn
-from motor.motor_asyncio import AsyncIOMotorClient
-from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+from datetime import datetime, timezone
 import asyncio
+import hashlib
+import json
+import os
 import numpy as np
 import pandas as pd
 
+import forward_sim
+from broadcast import ENCODINGS, MODES, SimulationHub, Subscriber
+from inference_queue import InferenceQueue
+from model import StockPredictor
+from monte_carlo import MonteCarloEngine
+from shared_model import SharedStockPredictor, ensure_published
+from state_cache import ChangeStreamListener, LatestStateCache, WarehouseStateCache
+from storage import INDEX_OPTIONS_CONFLICT, open_storage
+from write_buffer import WriteBehindBuffer
+
 app = FastAPI()
 
 # CORS middleware
@@ -20,15 +44,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# MongoDB connection
-MONGO_URL = "mongodb://localhost:27017"
-client = AsyncIOMotorClient(MONGO_URL)
-db = client.SupplyChain
-warehouse_collection = db.warehouses
-simulation_collection = db.simulations
-predictions_collection = db.predictions
-events_collection = db.events
-sentiment_collection = db.sentiment
+# Storage: MongoDB by default, STORAGE_BACKEND=memory runs without a server
+storage = open_storage()
+warehouse_collection = storage.warehouses
+simulation_collection = storage.simulations
+predictions_collection = storage.predictions
+events_collection = storage.events
+sentiment_collection = storage.sentiment
+
+# History writes (predictions, simulation states) are flushed in bulk
+write_buffer = WriteBehindBuffer(
+    max_pending=int(os.environ.get("WRITE_BUFFER_MAX_PENDING", "10000")),
+    flush_size=int(os.environ.get("WRITE_BUFFER_FLUSH_SIZE", "500")),
+    flush_interval=float(os.environ.get("WRITE_BUFFER_FLUSH_INTERVAL", "0.25")),
+)
+
+# Warehouse state served to the simulation loop without database reads
+warehouse_cache = WarehouseStateCache(warehouse_collection, write_buffer)
+warehouse_change_listener = ChangeStreamListener(warehouse_collection, warehouse_cache)
+latest_simulation_states = LatestStateCache(
+    simulation_collection, ttl=float(os.environ.get("SIMULATION_LATEST_TTL", "1.0"))
+)
 
 # Automotive parts inventory data
 AUTOMOTIVE_PARTS = {
@@ -165,20 +201,140 @@ MARKET_EVENTS = {
     },
 }
 
+# Columns of EVENT_IMPACTS
+SUPPLY, PRICE, SENTIMENT, SIGN, STOCK_MULTIPLIER, PRICE_MULTIPLIER = range(6)
+
+
+def compile_event_impacts(events):
+    """Compile an events dict into a name -> row index map and an impact table
+
+    Besides the raw supply/price/sentiment impacts and the event sign, each
+    row carries the stock and price multipliers the event applies, so
+    adjustments become array ops instead of per-item branching.
+    """
+    index = {name: i for i, name in enumerate(events)}
+    table = np.array(
+        [
+            [
+                e["supply_impact"],
+                e["price_impact"],
+                e["sentiment_score"],
+                1.0 if e["type"] == "positive" else -1.0,
+                0.0,
+                0.0,
+            ]
+            for e in events.values()
+        ],
+        dtype=np.float64,
+    ).reshape(len(events), 6)
+
+    positive = table[:, SIGN] > 0
+    # Negative events reduce stock and raise prices; positive ones the reverse
+    table[:, STOCK_MULTIPLIER] = np.where(
+        positive, 1 + table[:, SUPPLY], 1 - np.abs(table[:, SUPPLY])
+    )
+    table[:, PRICE_MULTIPLIER] = np.where(
+        positive, 1 - table[:, PRICE], 1 + np.abs(table[:, PRICE])
+    )
+    return index, table
+
+
+EVENT_INDEX, EVENT_IMPACTS = compile_event_impacts(MARKET_EVENTS)
+
+
+def normalize_events(market_event):
+    """Accept None, one event name or a list of simultaneous events"""
+    if not market_event:
+        return []
+    if isinstance(market_event, str):
+        return [market_event]
+    return list(market_event)
+
+
+def event_rows(market_event):
+    """Impact table rows for the given events; KeyError on unknown names"""
+    return EVENT_IMPACTS[[EVENT_INDEX[e] for e in normalize_events(market_event)]]
+
+
+def event_multipliers(market_event):
+    """Combined (stock, price) multipliers; simultaneous events compose"""
+    rows = event_rows(market_event)
+    return (
+        float(np.prod(rows[:, STOCK_MULTIPLIER])),
+        float(np.prod(rows[:, PRICE_MULTIPLIER])),
+    )
+
 
 class WarehousePredictionRequest(BaseModel):
     items: List[str]
     buy_prices: List[float]
     months: List[int]
     market_trends: List[str]
-    market_event: str = None
+    market_event: Union[str, List[str], None] = None
+    warehouse_id: Optional[str] = None
+
+    @field_validator("market_event")
+    @classmethod
+    def check_market_event(cls, market_event):
+        unknown = [e for e in normalize_events(market_event) if e not in EVENT_INDEX]
+        if unknown:
+            raise ValueError(f"Unknown market event {', '.join(map(repr, unknown))}")
+        return market_event
+
+    @model_validator(mode="after")
+    def check_lengths(self):
+        lengths = {
+            len(self.items),
+            len(self.buy_prices),
+            len(self.months),
+            len(self.market_trends),
+        }
+        if len(lengths) != 1:
+            raise ValueError(
+                "items, buy_prices, months and market_trends must be the same length"
+            )
+        return self
 
 
 class SimulationState(BaseModel):
     warehouse_id: str
     inventory: dict
     timestamp: datetime
-    market_event: str = None
+    market_event: Union[str, List[str], None] = None
+
+
+class ScheduledEvent(BaseModel):
+    event: str
+    start: int = Field(0, ge=0)
+    duration: int = Field(1, ge=1)
+    # Steps for the effect to halve after the event ends; 0 ends it abruptly
+    decay: float = Field(0.0, ge=0)
+
+
+class SimulationRequest(BaseModel):
+    steps: int = Field(30, ge=1, le=3650)
+    events: List[ScheduledEvent] = []
+    include_stock: bool = False
+    # Units each warehouse holds at 100% utilization; derived from the
+    # warehouse's current stock and utilization when omitted
+    capacity: Optional[float] = Field(None, gt=0)
+
+
+class ScenarioEvent(BaseModel):
+    event: str
+    probability: float = Field(1.0, ge=0, le=1)
+
+
+class MonteCarloRequest(BaseModel):
+    events: List[ScenarioEvent]
+    n_paths: int = Field(2000, ge=1, le=200_000)
+    steps: int = Field(90, ge=1, le=730)
+    seed: Optional[int] = None
+    min_duration: int = Field(3, ge=1)
+    max_duration: int = Field(30, ge=1)
+    demand_sigma: float = Field(0.3, ge=0)
+    # Days of stock the predicted level covers; sets the daily demand scale
+    days_of_cover: float = Field(30.0, gt=0)
 
 
 class SentimentData(BaseModel):
@@ -222,41 +378,66 @@ WAREHOUSES = [
 ]
 
 
-async def restore_warehouses():
-    try:
-        # Clear existing warehouses
-        await warehouse_collection.delete_many({})
-
-        # Initialize warehouses with automotive parts
-        for warehouse in WAREHOUSES:
-            inventory = []
-
-            for item, data in AUTOMOTIVE_PARTS.items():
-                stock = np.random.randint(50, 500)
-                inventory_item = {
+def build_warehouse_docs(warehouses, parts, rng=None):
+    """Seed documents with random inventories and metrics drawn as arrays"""
+    rng = rng or np.random.default_rng()
+    n_warehouses, n_parts = len(warehouses), len(parts)
+    stock = rng.integers(50, 500, size=(n_warehouses, n_parts)).tolist()
+    utilization = np.round(rng.uniform(60, 85, n_warehouses), 2).tolist()
+    turnover_rate = np.round(rng.uniform(10, 20, n_warehouses), 2).tolist()
+    efficiency = np.round(rng.uniform(75, 95, n_warehouses), 2).tolist()
+
+    now = datetime.now(timezone.utc)
+    part_items = list(parts.items())
+    return [
+        {
+            **warehouse,
+            "inventory": [
+                {
                     "item": item,
-                    "stock": stock,
+                    "stock": stock[w][i],
                     "buyPrice": data["buy_price"],
                     "sellPrice": data["sell_price"],
                     "marketCondition": data["trend"],
-                    "lastUpdated": datetime.now(),
+                    "lastUpdated": now,
                 }
-                inventory.append(inventory_item)
+                for i, (item, data) in enumerate(part_items)
+            ],
+            "created_at": now,
+            "last_updated": now,
+            "status": "active",
+            "metrics": {
+                "utilization": utilization[w],
+                "turnover_rate": turnover_rate[w],
+                "efficiency": efficiency[w],
+            },
+        }
+        for w, warehouse in enumerate(warehouses)
+    ]
 
-            warehouse_doc = {
-                **warehouse,
-                "inventory": inventory,
-                "created_at": datetime.now(),
-                "last_updated": datetime.now(),
-                "status": "active",
-                "metrics": {
-                    "utilization": round(np.random.uniform(60, 85), 2),
-                    "turnover_rate": round(np.random.uniform(10, 20), 2),
-                    "efficiency": round(np.random.uniform(75, 95), 2),
-                },
-            }
 
-            await warehouse_collection.insert_one(warehouse_doc)
+async def restore_warehouses(force=False):
+    """Seed missing warehouses with one bulk upsert keyed on `id`
+
+    Existing warehouses keep their live state unless `force` is set, in
+    which case they are overwritten with fresh seed data.
+    """
+    try:
+        ids = [warehouse["id"] for warehouse in WAREHOUSES]
+        if not force:
+            existing = await warehouse_collection.count_documents({"id": {"$in": ids}})
+            if existing == len(ids):
+                print("Warehouses already present, skipping seeding")
+                return
+
+        operator = "$set" if force else "$setOnInsert"
+        await warehouse_collection.bulk_write(
+            [
+                UpdateOne({"id": doc["id"]}, {operator: doc}, upsert=True)
+                for doc in build_warehouse_docs(WAREHOUSES, AUTOMOTIVE_PARTS)
+            ],
+            ordered=False,
+        )
 
         print("Warehouses restored successfully")
 
@@ -265,74 +446,166 @@ async def restore_warehouses():
         raise e
 
 
+# History documents older than this are expired by TTL indexes; 0 keeps them
+HISTORY_RETENTION_SECONDS = int(
+    os.environ.get("HISTORY_RETENTION_SECONDS", str(7 * 24 * 3600))
+)
+
+
+def index_specs(retention_seconds=HISTORY_RETENTION_SECONDS):
+    """(collection, keys, options) for every index the app's queries rely on"""
+    specs = [
+        (warehouse_collection, [("id", 1)], {"unique": True}),
+        (predictions_collection, [("warehouse_id", 1), ("timestamp", -1)], {}),
+        (simulation_collection, [("warehouse_id", 1), ("timestamp", -1)], {}),
+        # Partial so sentiment documents written before etags existed do not
+        # all collide on a null etag
+        (
+            sentiment_collection,
+            [("etag", 1), ("item", 1)],
+            {"unique": True, "partialFilterExpression": {"etag": {"$exists": True}}},
+        ),
+    ]
+    if retention_seconds > 0:
+        specs += [
+            (collection, [("timestamp", 1)], {"expireAfterSeconds": retention_seconds})
+            for collection in (
+                predictions_collection,
+                simulation_collection,
+                sentiment_collection,
+            )
+        ]
+    return specs
+
+
+async def ensure_indexes(retention_seconds=HISTORY_RETENTION_SECONDS):
+    """Create missing indexes; existing TTL indexes get the new retention
+
+    Failures are logged rather than raised so a bad index (e.g. duplicate
+    warehouse ids) does not keep the API from starting.
+    """
+    for collection, keys, options in index_specs(retention_seconds):
+        try:
+            try:
+                await collection.create_index(keys, **options)
+            except OperationFailure as e:
+                ttl_conflict = (
+                    e.code == INDEX_OPTIONS_CONFLICT and "expireAfterSeconds" in options
+                )
+                if not ttl_conflict:
+                    raise
+                await collection.database.command(
+                    {
+                        "collMod": collection.name,
+                        "index": {
+                            "keyPattern": dict(keys),
+                            "expireAfterSeconds": options["expireAfterSeconds"],
+                        },
+                    }
+                )
+        except Exception as e:
+            print(f"Error creating index {keys} on {collection.name}: {e}")
+
+
 # Create base DataFrame from AUTOMOTIVE_PARTS
 df = pd.DataFrame(AUTOMOTIVE_PARTS).T.reset_index()
 df.columns = ["Item", "Price", "BuyPrice", "SellPrice", "Trend"]
 ACTUAL_ITEMS = df["Item"].tolist()
 
 
+_stock_predictor = None
+
+
+def get_stock_predictor():
+    """Attach to the shared published model, publishing one first if needed
+
+    The first worker to start loads or trains the model and publishes it;
+    every worker then maps the same generation and follows newer ones. If
+    the shared directory is unusable the worker keeps a private model.
+    """
+    global _stock_predictor
+    if _stock_predictor is None:
+        try:
+            ensure_published(StockPredictor)
+            _stock_predictor = SharedStockPredictor()
+        except OSError as e:
+            print(f"Shared model unavailable, using a private copy: {e}")
+            _stock_predictor = StockPredictor()
+    return _stock_predictor
+
+
+def predict_stock_batch(items, buy_prices, months, market_trends):
+    """Batched, cached mean and confidence; called from the inference executor"""
+    return get_stock_predictor().predict_with_confidence(
+        items, buy_prices, months, market_trends
+    )
+
+
+def prediction_cache_stats():
+    """Stats of the loaded predictor's cache; None before loading or if uncached"""
+    cache = getattr(_stock_predictor, "cache", None)
+    return cache.stats() if cache is not None else None
+
+
+def warm_stock_predictor():
+    """Load the model ahead of the first request without failing startup"""
+    try:
+        get_stock_predictor()
+    except Exception as e:
+        print(f"Error loading stock predictor: {e}")
+
+
+inference_queue = InferenceQueue(
+    predict_stock_batch,
+    max_batch_size=int(os.environ.get("INFERENCE_MAX_BATCH", "256")),
+    max_wait_ms=float(os.environ.get("INFERENCE_MAX_WAIT_MS", "5")),
+)
+
+
 class WarehousePredictor:
-    def predict_real_time(
+    async def predict_real_time(
         self, items, buy_prices, months, market_trends, market_event=None
     ):
-        predictions = []
-        for i, item in enumerate(items):
-            base_prediction = np.random.normal(100, 20)
-            confidence = np.random.uniform(0.7, 0.9)
-
-            if market_event:
-                event_data = MARKET_EVENTS[market_event]
-                event_impact = event_data["supply_impact"]
-                sentiment_impact = event_data["sentiment_score"]
-                price_impact = event_data["price_impact"]
-
-                # Fix: For negative events, reduce stock
-                if event_data["type"] == "negative":
-                    base_prediction *= 1 - abs(
-                        event_impact
-                    )  # Changed from 1 + event_impact
-                    buy_prices[i] *= 1 + abs(
-                        price_impact
-                    )  # Increase prices for negative events
-                else:
-                    base_prediction *= 1 + event_impact
-                    buy_prices[i] *= (
-                        1 - price_impact
-                    )  # Decrease prices for positive events
-
-            predictions.append(
-                {
-                    "item": item,
-                    "predicted_stock": max(0, int(base_prediction)),
-                    "confidence": round(confidence, 2),
-                    "market_trend": market_trends[i],
-                    "adjusted_buy_price": round(buy_prices[i], 2),
-                }
+        base = await inference_queue.submit(items, buy_prices, months, market_trends)
+        stock_multiplier, price_multiplier = event_multipliers(market_event)
+
+        predicted_stock = np.maximum(0, (base["mean"] * stock_multiplier).astype(int))
+        adjusted_prices = np.round(
+            np.asarray(buy_prices, dtype=np.float64) * price_multiplier, 2
+        )
+        confidence = np.round(base["confidence"], 2)
+
+        return [
+            {
+                "item": item,
+                "predicted_stock": stock,
+                "confidence": conf,
+                "market_trend": trend,
+                "adjusted_buy_price": price,
+            }
+            for item, stock, conf, trend, price in zip(
+                items,
+                predicted_stock.tolist(),
+                confidence.tolist(),
+                market_trends,
+                adjusted_prices.tolist(),
             )
-        return predictions
+        ]
 
     def calculate_utilization(self, current_stock, capacity, market_event=None):
-        base_utilization = (current_stock / capacity) * 100
-
-        if market_event:
-            event_data = MARKET_EVENTS[market_event]
-            supply_impact = event_data["supply_impact"]
-            # Fix: Apply negative impact correctly
-            if event_data["type"] == "negative":
-                base_utilization *= 1 - abs(supply_impact)
-            else:
-                base_utilization *= 1 + supply_impact
-
+        stock_multiplier, _ = event_multipliers(market_event)
+        base_utilization = (current_stock / capacity) * 100 * stock_multiplier
         return min(100, max(0, round(base_utilization, 2)))
 
 
 class MarketEventPredictor:
     def predict_market_impact(self, event, current_state):
-        event_data = MARKET_EVENTS[event]
+        # Raw impacts of simultaneous events are summed
+        rows = event_rows(event)
         return {
-            "price_impact": event_data["price_impact"],
-            "supply_impact": event_data["supply_impact"],
-            "sentiment_score": event_data["sentiment_score"],
+            "price_impact": round(float(rows[:, PRICE].sum()), 4),
+            "supply_impact": round(float(rows[:, SUPPLY].sum()), 4),
+            "sentiment_score": round(float(rows[:, SENTIMENT].sum()), 4),
         }
 
 
@@ -340,6 +613,20 @@ warehouse_predictor = WarehousePredictor()
 market_predictor = MarketEventPredictor()
 
 
+def market_event_docs():
+    """Documents for the events collection, one per known market event"""
+    return [
+        {
+            "event_id": event_id,
+            **event_data,
+            "created_at": datetime.now(timezone.utc),
+            "active": True,
+            "last_triggered": None,
+        }
+        for event_id, event_data in MARKET_EVENTS.items()
+    ]
+
+
 async def init_warehouse_data():
     try:
         # Clear existing collections
@@ -364,7 +651,7 @@ async def init_warehouse_data():
                     "buyPrice": data["buy_price"],
                     "sellPrice": data["sell_price"],
                     "marketCondition": data["trend"],
-                    "lastUpdated": datetime.now(),
+                    "lastUpdated": datetime.now(timezone.utc),
                 }
                 inventory.append(inventory_item)
 
@@ -381,8 +668,8 @@ async def init_warehouse_data():
             warehouse_doc = {
                 **warehouse,
                 "inventory": inventory,
-                "created_at": datetime.now(),
-                "last_updated": datetime.now(),
+                "created_at": datetime.now(timezone.utc),
+                "last_updated": datetime.now(timezone.utc),
                 "status": "active",
                 "metrics": {
                     "utilization": round(np.random.uniform(60, 85), 2),
@@ -396,7 +683,7 @@ async def init_warehouse_data():
             initial_sim_state = {
                 "warehouse_id": warehouse["id"],
                 "inventory": inventory,
-                "timestamp": datetime.now(),
+                "timestamp": datetime.now(timezone.utc),
                 "status": "initialized",
                 "metrics": warehouse_doc["metrics"],
             }
@@ -406,14 +693,7 @@ async def init_warehouse_data():
                 await predictions_collection.insert_many(initial_predictions)
 
         # Initialize market events
-        for event_id, event_data in MARKET_EVENTS.items():
-            event_doc = {
-                "event_id": event_id,
-                **event_data,
-                "created_at": datetime.now(),
-                "active": True,
-                "last_triggered": None,
-            }
+        for event_doc in market_event_docs():
             await events_collection.insert_one(event_doc)
 
         print("MongoDB collections initialized successfully")
@@ -425,36 +705,122 @@ async def init_warehouse_data():
 
 @app.on_event("startup")
 async def startup_event():
-    await restore_warehouses()
+    inference_queue.start()
+    write_buffer.start()
+    asyncio.get_running_loop().run_in_executor(
+        inference_queue.executor, warm_stock_predictor
+    )
+    await ensure_indexes()
+    await restore_warehouses(force=os.environ.get("RESEED_WAREHOUSES") == "1")
+    await warehouse_cache.load()
+    if os.environ.get("WAREHOUSE_CHANGE_STREAM", "1") == "1":
+        warehouse_change_listener.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await simulation_hub.close()
+    monte_carlo_engine.shutdown()
+    await warehouse_change_listener.stop()
+    await inference_queue.stop()
+    await write_buffer.close()
+    storage.close()
+
+
+def compute_sentiment(parts):
+    """Sentiment per part, derived from its market trend"""
+    sentiment_data = []
+    for item, data in parts.items():
+        base_sentiment = 0.5
+        if data["trend"].lower() == "bullish":
+            sentiment = min(1.0, base_sentiment + 0.3)
+        elif data["trend"].lower() == "bearish":
+            sentiment = max(0.0, base_sentiment - 0.3)
+        else:
+            sentiment = base_sentiment
+
+        sentiment_data.append(
+            {
+                "item": item,
+                "sentiment": round(sentiment, 2),
+                "trend": data["trend"].lower(),
+                "description": f"Market trend is {data['trend'].lower()}",
+            }
+        )
+    return sentiment_data
+
+
+class SentimentSnapshot:
+    """Serialized /sentiment response, recomputed only when its inputs change"""
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.inputs = None
+        self.data = None
+        self.body = None
+        self.etag = None
+        self.persisted_etag = None
+
+    def current(self):
+        inputs = tuple((item, data["trend"]) for item, data in self.parts.items())
+        if inputs != self.inputs:
+            self.data = compute_sentiment(self.parts)
+            self.body = json.dumps(self.data).encode()
+            self.etag = f'"{hashlib.sha1(self.body).hexdigest()[:16]}"'
+            self.inputs = inputs
+        return self
+
+    def matches(self, if_none_match):
+        if not if_none_match:
+            return False
+        tags = [t.strip() for t in if_none_match.split(",")]
+        return "*" in tags or any(t.removeprefix("W/") == self.etag for t in tags)
+
+
+sentiment_snapshot = SentimentSnapshot(AUTOMOTIVE_PARTS)
+SENTIMENT_PERSIST = os.environ.get("SENTIMENT_PERSIST", "1") == "1"
+
+
+async def persist_sentiment_snapshot(etag, sentiment_data):
+    """Store a snapshot once; upserts keyed on (etag, item) are idempotent"""
+    try:
+        timestamp = datetime.now(timezone.utc)
+        await sentiment_collection.bulk_write(
+            [
+                UpdateOne(
+                    {"etag": etag, "item": data["item"]},
+                    {"$setOnInsert": {**data, "etag": etag, "timestamp": timestamp}},
+                    upsert=True,
+                )
+                for data in sentiment_data
+            ],
+            ordered=False,
+        )
+    except Exception as e:
+        print(f"Error persisting sentiment snapshot: {e}")
+        # Let a later request retry
+        if sentiment_snapshot.persisted_etag == etag:
+            sentiment_snapshot.persisted_etag = None
 
 
 @app.get("/sentiment")
-async def get_sentiment():
+async def get_sentiment(request: Request, background_tasks: BackgroundTasks):
     try:
-        sentiment_data = []
-        for item, data in AUTOMOTIVE_PARTS.items():
-            base_sentiment = 0.5
-            if data["trend"].lower() == "bullish":
-                sentiment = min(1.0, base_sentiment + 0.3)
-            elif data["trend"].lower() == "bearish":
-                sentiment = max(0.0, base_sentiment - 0.3)
-            else:
-                sentiment = base_sentiment
-
-            sentiment_data.append(
-                {
-                    "item": item,
-                    "sentiment": round(sentiment, 2),
-                    "trend": data["trend"].lower(),
-                    "description": f"Market trend is {data['trend'].lower()}",
-                }
+        snapshot = sentiment_snapshot.current()
+        headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+
+        if SENTIMENT_PERSIST and snapshot.persisted_etag != snapshot.etag:
+            snapshot.persisted_etag = snapshot.etag
+            background_tasks.add_task(
+                persist_sentiment_snapshot, snapshot.etag, snapshot.data
             )
 
-        await sentiment_collection.insert_many(
-            [{**data, "timestamp": datetime.now()} for data in sentiment_data]
-        )
+        if snapshot.matches(request.headers.get("if-none-match")):
+            return Response(status_code=304, headers=headers)
 
-        return sentiment_data
+        return Response(
+            content=snapshot.body, media_type="application/json", headers=headers
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -468,32 +834,92 @@ async def get_market_events():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+WAREHOUSE_FIELDS = ("id", "name", "location", "coordinates", "inventory", "metrics")
+
+
+def parse_warehouse_fields(fields):
+    """Validate a comma-separated field list; `id` is always returned"""
+    if fields is None:
+        return list(WAREHOUSE_FIELDS)
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = sorted(set(selected) - set(WAREHOUSE_FIELDS))
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown fields: {', '.join(unknown)}"
+        )
+    return ["id"] + [f for f in WAREHOUSE_FIELDS if f in selected and f != "id"]
+
+
+def warehouse_view(doc, fields):
+    return {"_id": str(doc["_id"]), **{f: doc[f] for f in fields}}
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+async def stream_warehouses(cursor, fields):
+    """NDJSON lines serialized as the cursor yields documents"""
+    async for doc in cursor:
+        yield json.dumps(warehouse_view(doc, fields), default=json_default) + "\n"
+
+
 @app.get("/warehouse-data")
-async def get_warehouse_data():
+async def get_warehouse_data(
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    """Warehouses ordered by `id`, optionally paginated, projected or streamed
+
+    Pass the returned `next_after` as `after` to fetch the next page;
+    `fields=metrics,coordinates` returns only those (plus `id`), and
+    `format=ndjson` streams one document per line.
+    """
+    selected = parse_warehouse_fields(fields)
     try:
-        warehouses = await warehouse_collection.find({}).to_list(length=None)
-        return {
-            "warehouses": [
-                {
-                    "_id": str(w["_id"]),
-                    "id": w["id"],
-                    "name": w["name"],
-                    "location": w["location"],
-                    "coordinates": w["coordinates"],
-                    "inventory": w["inventory"],
-                    "metrics": w["metrics"],
-                }
-                for w in warehouses
-            ]
-        }
+        query = {"id": {"$gt": after}} if after is not None else {}
+        cursor = warehouse_collection.find(
+            query, {f: 1 for f in selected}, batch_size=100
+        ).sort("id", 1)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+
+        if format == "ndjson":
+            return StreamingResponse(
+                stream_warehouses(cursor, selected), media_type="application/x-ndjson"
+            )
+
+        warehouses = [warehouse_view(w, selected) async for w in cursor]
+        response = {"warehouses": warehouses}
+        if limit is not None:
+            response["next_after"] = (
+                warehouses[-1]["id"] if len(warehouses) == limit else None
+            )
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/metrics")
+async def get_metrics():
+    return {
+        "write_buffer": write_buffer.stats(),
+        "inference_queue": inference_queue.stats(),
+        "warehouse_cache": warehouse_cache.stats(),
+        "simulation_hub": simulation_hub.stats(),
+        "latest_simulation_states": latest_simulation_states.stats(),
+        "prediction_cache": prediction_cache_stats(),
+    }
+
+
 @app.post("/predict_warehouse")
 async def predict_warehouse_stock(request: WarehousePredictionRequest):
     try:
-        predictions = warehouse_predictor.predict_real_time(
+        predictions = await warehouse_predictor.predict_real_time(
             request.items,
             request.buy_prices,
             request.months,
@@ -503,124 +929,422 @@ async def predict_warehouse_stock(request: WarehousePredictionRequest):
 
         prediction_doc = {
             "predictions": predictions,
-            "timestamp": datetime.now(),
+            "timestamp": datetime.now(timezone.utc),
             **request.dict(),
         }
-        await predictions_collection.insert_one(prediction_doc)
+        await write_buffer.insert(predictions_collection, prediction_doc)
 
         return {"predictions": predictions}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.websocket("/ws/simulation")
-async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
+# Per-step (stock, price) drift by market trend: bullish demand draws stock
+# down and lifts prices, bearish demand does the reverse
+TREND_DRIFT = {"bullish": (-0.002, 0.001), "bearish": (0.002, -0.001)}
+MAX_STOCK_CELLS = 1_000_000
+# Used for a warehouse whose capacity cannot be derived from its metrics
+DEFAULT_CAPACITY = 1000.0
+
+
+def warehouse_capacity(warehouse):
+    """Units at 100% utilization, from the current stock and utilization"""
+    utilization = warehouse["metrics"].get("utilization") or 0
+    if utilization <= 0 or warehouse["total_stock"] <= 0:
+        return DEFAULT_CAPACITY
+    return warehouse["total_stock"] / (utilization / 100)
+
+
+async def warehouse_stock_matrix(items):
+    """Warehouse ids, their cache entries (None if missing) and stock per item
+
+    Stock is a (warehouses, items) matrix read from the warehouse cache;
+    missing warehouses and items count as zero.
+    """
+    warehouse_ids = [w["id"] for w in WAREHOUSES]
+    warehouses = [await warehouse_cache.get(w) for w in warehouse_ids]
+    initial_stock = np.zeros((len(warehouse_ids), len(items)))
+    for w, warehouse in enumerate(warehouses):
+        if warehouse is None:
+            continue
+        inventory = warehouse["doc"]["inventory"]
+        stock = {entry["item"]: entry["stock"] for entry in inventory}
+        initial_stock[w] = [stock.get(item, 0) for item in items]
+    return warehouse_ids, warehouses, initial_stock
+
+
+def event_schedule(events):
+    """Arrays of start, duration, half-life and multipliers per scheduled event"""
+    rows = event_rows([e.event for e in events])
+    return {
+        "start": [e.start for e in events],
+        "duration": [e.duration for e in events],
+        "half_life": [e.decay for e in events],
+        "stock_multiplier": rows[:, STOCK_MULTIPLIER],
+        "price_multiplier": rows[:, PRICE_MULTIPLIER],
+    }
+
+
+@app.post("/simulate")
+async def simulate(request: SimulationRequest):
+    """Project every warehouse's inventory, prices and utilization forward"""
     try:
-        while True:
-            data = await websocket.receive_json()
+        schedule = event_schedule(request.events)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown market event {e}")
 
-            # Get current warehouse data
-            warehouse = await warehouse_collection.find_one(
-                {"id": data.get("warehouse_id", "1")}
-            )
+    try:
+        items = list(AUTOMOTIVE_PARTS)
+        warehouse_ids, warehouses, initial_stock = await warehouse_stock_matrix(items)
+        capacity = np.array(
+            [
+                request.capacity or warehouse_capacity(warehouse)
+                if warehouse is not None
+                else DEFAULT_CAPACITY
+                for warehouse in warehouses
+            ]
+        )
 
-            predictions = warehouse_predictor.predict_real_time(
-                data["items"],
-                data["buy_prices"],
-                data["months"],
-                data["market_trends"],
-                data.get("market_event"),
-            )
+        drift = np.array(
+            [
+                TREND_DRIFT.get(part["trend"].lower(), (0.0, 0.0))
+                for part in AUTOMOTIVE_PARTS.values()
+            ]
+        )
+        projection = forward_sim.project(
+            initial_stock,
+            [p["buy_price"] for p in AUTOMOTIVE_PARTS.values()],
+            request.steps,
+            schedule,
+            stock_drift=drift[:, 0],
+            price_drift=drift[:, 1],
+            capacity=capacity,
+        )
 
-            market_impact = None
-            if data.get("market_event"):
-                event_data = MARKET_EVENTS[data["market_event"]]
-                market_impact = market_predictor.predict_market_impact(
-                    data["market_event"],
-                    {"prices": data["buy_prices"], "trends": data["market_trends"]},
+        response = {
+            "steps": request.steps,
+            "warehouses": warehouse_ids,
+            "items": items,
+            "utilization": np.round(projection.utilization(), 2).tolist(),
+            "total_stock": np.round(projection.total_stock(), 2).tolist(),
+            "buy_prices": np.round(projection.prices, 2).tolist(),
+            "event_intensity": np.round(projection.intensity, 4).tolist(),
+        }
+        if request.include_stock:
+            if initial_stock.size * request.steps > MAX_STOCK_CELLS:
+                raise HTTPException(
+                    status_code=400, detail="Stock cube too large; lower steps"
                 )
+            response["stock"] = np.round(projection.stock(), 2).tolist()
+        return response
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-                # Update warehouse metrics based on event
-                new_metrics = {
-                    "utilization": warehouse_predictor.calculate_utilization(
-                        sum(item["stock"] for item in warehouse["inventory"]),
-                        1000,  # Assume max capacity
-                        data["market_event"],
-                    ),
-                    "turnover_rate": round(
-                        warehouse["metrics"]["turnover_rate"]
-                        * (1 + event_data["supply_impact"]),
-                        2,
-                    ),
-                    "efficiency": round(
-                        warehouse["metrics"]["efficiency"]
-                        * (1 + event_data["sentiment_score"] * 0.1),
-                        2,
-                    ),
-                }
 
-                # Update warehouse metrics
-                await warehouse_collection.update_one(
-                    {"id": warehouse["id"]}, {"$set": {"metrics": new_metrics}}
-                )
+monte_carlo_engine = MonteCarloEngine(
+    max_workers=int(os.environ.get("MONTE_CARLO_WORKERS", "0")) or None,
+    shard_paths=int(os.environ.get("MONTE_CARLO_SHARD_PATHS", "500")),
+    max_shards=int(os.environ.get("MONTE_CARLO_MAX_SHARDS", "64")),
+    summary_interval=float(os.environ.get("MONTE_CARLO_SUMMARY_INTERVAL", "0.25")),
+)
 
-            sim_state = {
-                "warehouse_id": data.get("warehouse_id", "1"),
-                "inventory": {
-                    "items": data["items"],
-                    "predictions": predictions,
-                    "buy_prices": data["buy_prices"],
-                    "market_trends": data["market_trends"],
-                },
-                "market_event": data.get("market_event"),
-                "market_impact": market_impact,
-                "timestamp": datetime.now(),
+
+async def scenario_inputs(days_of_cover):
+    """Initial stock and expected daily demand per (warehouse, item)
+
+    The stock predictor's expected level for each item sets the demand
+    scale: that level is taken to cover `days_of_cover` days of demand.
+    """
+    items = list(AUTOMOTIVE_PARTS)
+    warehouse_ids, _, initial_stock = await warehouse_stock_matrix(items)
+
+    predicted = await inference_queue.submit(
+        items,
+        [part["buy_price"] for part in AUTOMOTIVE_PARTS.values()],
+        [datetime.now().month] * len(items),
+        [part["trend"] for part in AUTOMOTIVE_PARTS.values()],
+    )
+    daily_demand = np.maximum(predicted["mean"], 1.0) / days_of_cover
+    return warehouse_ids, items, initial_stock, np.broadcast_to(
+        daily_demand, initial_stock.shape
+    )
+
+
+def scenario_summary_view(summary, seed, warehouse_ids, items):
+    def table(values):
+        return np.round(values, 4).tolist()
+
+    return {
+        "seed": seed,
+        "paths": summary["paths"],
+        "total_paths": summary["total_paths"],
+        "done": summary["done"],
+        "warehouses": warehouse_ids,
+        "items": items,
+        "stockout_probability": table(summary["stockout_probability"]),
+        "final_stock": {k: table(v) for k, v in summary["final_stock"].items()},
+        "min_stock": {k: table(v) for k, v in summary["min_stock"].items()},
+    }
+
+
+@app.post("/monte-carlo")
+async def run_monte_carlo(request: MonteCarloRequest):
+    """Stream NDJSON stockout risk summaries as scenario shards complete
+
+    Each line covers every path finished so far, at most one line per
+    summary interval; the last has "done": true.
+    Passing the returned seed back reproduces a run exactly.
+    """
+    if request.min_duration > request.max_duration:
+        raise HTTPException(
+            status_code=400, detail="min_duration must not exceed max_duration"
+        )
+    try:
+        rows = event_rows([e.event for e in request.events])
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown market event {e}")
+
+    try:
+        warehouse_ids, items, initial_stock, daily_demand = await scenario_inputs(
+            request.days_of_cover
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    seed = (
+        request.seed
+        if request.seed is not None
+        else int(np.random.SeedSequence().entropy % 2**63)
+    )
+
+    async def lines():
+        async for summary in monte_carlo_engine.stream(
+            initial_stock,
+            daily_demand,
+            rows[:, STOCK_MULTIPLIER],
+            [e.probability for e in request.events],
+            n_paths=request.n_paths,
+            steps=request.steps,
+            seed=seed,
+            duration_range=(request.min_duration, request.max_duration),
+            demand_sigma=request.demand_sigma,
+        ):
+            view = scenario_summary_view(summary, seed, warehouse_ids, items)
+            yield json.dumps(view) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+def simulation_state_view(state):
+    return {k: v for k, v in state.items() if k != "_id"}
+
+
+@app.post("/simulation/state")
+async def save_simulation_state(state: SimulationState):
+    try:
+        timestamp = state.timestamp
+        # History timestamps are aware UTC; naive input is taken to be UTC
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        else:
+            timestamp = timestamp.astimezone(timezone.utc)
+        doc = {**state.dict(), "timestamp": timestamp}
+
+        await write_buffer.insert(simulation_collection, doc)
+        # A copy, since the buffered insert adds `_id` to `doc` when flushed
+        latest = latest_simulation_states.offer(dict(doc))
+        return {"status": "saved", "latest": latest}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/simulation/latest/{warehouse_id}")
+async def get_latest_simulation_state(warehouse_id: str):
+    try:
+        state = await latest_simulation_states.get(warehouse_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if state is None:
+        raise HTTPException(
+            status_code=404, detail=f"No simulation state for warehouse {warehouse_id}"
+        )
+    return simulation_state_view(state)
+
+
+async def simulation_tick(topic):
+    """One simulation update for a (warehouse_id, events) topic"""
+    warehouse_id, events = topic
+    market_event = list(events) or None
+    warehouse = await warehouse_cache.get(warehouse_id)
+    if warehouse is None:
+        raise KeyError(f"Unknown warehouse {warehouse_id}")
+
+    inventory = warehouse["doc"]["inventory"]
+    items = [entry["item"] for entry in inventory]
+    buy_prices = [entry["buyPrice"] for entry in inventory]
+    market_trends = [entry["marketCondition"] for entry in inventory]
+    months = [datetime.now().month] * len(items)
+
+    predictions = await warehouse_predictor.predict_real_time(
+        items, buy_prices, months, market_trends, market_event
+    )
+
+    market_impact = None
+    rows = event_rows(market_event)
+    if market_event:
+        market_impact = market_predictor.predict_market_impact(
+            market_event, {"prices": buy_prices, "trends": market_trends}
+        )
+
+        # Update warehouse metrics based on event
+        new_metrics = {
+            "utilization": warehouse_predictor.calculate_utilization(
+                warehouse["total_stock"],
+                1000,  # Assume max capacity
+                market_event,
+            ),
+            "turnover_rate": round(
+                warehouse["metrics"]["turnover_rate"]
+                * float(np.prod(1 + rows[:, SUPPLY])),
+                2,
+            ),
+            "efficiency": round(
+                warehouse["metrics"]["efficiency"]
+                * float(np.prod(1 + rows[:, SENTIMENT] * 0.1)),
+                2,
+            ),
+        }
+
+        # Update warehouse metrics (cache and write-through)
+        await warehouse_cache.update_metrics(warehouse_id, new_metrics)
+
+    sim_state = {
+        "warehouse_id": warehouse_id,
+        "inventory": {
+            "items": items,
+            "predictions": predictions,
+            "buy_prices": buy_prices,
+            "market_trends": market_trends,
+        },
+        "market_event": market_event,
+        "market_impact": market_impact,
+        "timestamp": datetime.now(timezone.utc),
+    }
+
+    await write_buffer.insert(simulation_collection, sim_state)
+    latest_simulation_states.offer(dict(sim_state))
+
+    # Calculate updated sentiment data
+    event_sentiment = float(rows[:, SENTIMENT].sum())
+    sentiment_data = []
+    for item, item_data in AUTOMOTIVE_PARTS.items():
+        base_sentiment = 0.5 + event_sentiment * 0.3
+
+        if item_data["trend"].lower() == "bullish":
+            sentiment = min(1.0, base_sentiment + 0.3)
+        elif item_data["trend"].lower() == "bearish":
+            sentiment = max(0.0, base_sentiment - 0.3)
+        else:
+            sentiment = base_sentiment
+
+        sentiment_data.append(
+            {
+                "item": item,
+                "sentiment": round(sentiment, 2),
+                "trend": item_data["trend"].lower(),
+                "description": f"Market trend is {item_data['trend'].lower()}",
             }
+        )
 
-            await simulation_collection.insert_one(sim_state)
-
-            # Calculate updated sentiment data
-            sentiment_data = []
-            for item, item_data in AUTOMOTIVE_PARTS.items():
-                base_sentiment = 0.5
-                if data.get("market_event"):
-                    event_sentiment = MARKET_EVENTS[data["market_event"]][
-                        "sentiment_score"
-                    ]
-                    base_sentiment += event_sentiment * 0.3
-
-                if item_data["trend"].lower() == "bullish":
-                    sentiment = min(1.0, base_sentiment + 0.3)
-                elif item_data["trend"].lower() == "bearish":
-                    sentiment = max(0.0, base_sentiment - 0.3)
-                else:
-                    sentiment = base_sentiment
-
-                sentiment_data.append(
-                    {
-                        "item": item,
-                        "sentiment": round(sentiment, 2),
-                        "trend": item_data["trend"].lower(),
-                        "description": f"Market trend is {item_data['trend'].lower()}",
-                    }
-                )
+    return {
+        "predictions": predictions,
+        "market_impact": market_impact,
+        "sentiment_data": sentiment_data,
+    }
+
+
+# One tick per (warehouse, event) topic, shared by all of its subscribers
+simulation_hub = SimulationHub(
+    simulation_tick,
+    tick_interval=float(os.environ.get("SIMULATION_TICK_SECONDS", "1.0")),
+    queue_size=int(os.environ.get("SIMULATION_QUEUE_SIZE", "2")),
+)
 
-            await websocket.send_json(
-                {
-                    "predictions": predictions,
-                    "market_impact": market_impact,
-                    "sentiment_data": sentiment_data,
-                }
-            )
 
-            await asyncio.sleep(1)
+async def send_simulation_updates(websocket, subscriber):
+    while True:
+        payload = subscriber.render(await subscriber.queue.get())
+        if isinstance(payload, bytes):
+            await websocket.send_bytes(payload)
+        else:
+            await websocket.send_text(payload)
+
+
+def log_sender_error(task):
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None and not isinstance(error, WebSocketDisconnect):
+        print(f"WebSocket send error: {error}")
+
+
+@app.websocket("/ws/simulation")
+async def websocket_endpoint(websocket: WebSocket):
+    """Subscribe to a warehouse's simulation updates
+
+    Each message selects the topic, e.g. {"warehouse_id": "2",
+    "market_event": "labor_strike"}; updates for it are pushed every tick
+    until the client switches topics or disconnects.
+
+    The query string negotiates the frame protocol: `mode=delta` sends a
+    snapshot followed by per-item deltas with sequence numbers (a client
+    that sees a gap sends {"resync": true}), and `encoding=msgpack` sends
+    binary MessagePack frames. The default is full JSON messages.
+    """
+    mode = websocket.query_params.get("mode", "full")
+    encoding = websocket.query_params.get("encoding", "json")
+    await websocket.accept()
+    if mode not in MODES or encoding not in ENCODINGS:
+        await websocket.send_json(
+            {"error": f"Unsupported mode {mode!r} or encoding {encoding!r}"}
+        )
+        await websocket.close(code=1003)
+        return
+
+    subscriber = Subscriber(simulation_hub.queue_size, mode, encoding)
+    sender = asyncio.create_task(send_simulation_updates(websocket, subscriber))
+    sender.add_done_callback(log_sender_error)
+    try:
+        while True:
+            data = await websocket.receive_json()
+            if data.get("resync"):
+                simulation_hub.resync(subscriber)
+                continue
+
+            warehouse_id = str(data.get("warehouse_id", "1"))
+            try:
+                events = tuple(normalize_events(data.get("market_event")))
+                event_rows(events)
+            except KeyError as e:
+                subscriber.error(f"Unknown market event {e}")
+                continue
+            if await warehouse_cache.get(warehouse_id) is None:
+                subscriber.error(f"Unknown warehouse {warehouse_id}")
+                continue
+
+            simulation_hub.subscribe((warehouse_id, events), subscriber)
 
     except WebSocketDisconnect:
         print("WebSocket disconnected")
     except Exception as e:
         print(f"WebSocket error: {e}")
         await websocket.close()
+    finally:
+        simulation_hub.unsubscribe(subscriber)
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,241 @@
+import asyncio
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MODES = ("full", "delta")
+ENCODINGS = ("json", "msgpack") if msgpack is not None else ("json",)
+KEYED_SECTIONS = ("predictions", "sentiment_data")
+
+
+def _keyed(message):
+    state = {
+        section: {row["item"]: row for row in message[section]}
+        for section in KEYED_SECTIONS
+    }
+    state["market_impact"] = message["market_impact"]
+    return state
+
+
+def _encode(payload, encoding):
+    if encoding == "msgpack":
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+
+class SimulationFrame:
+    """One tick's update, rendered at most once per (kind, encoding)
+
+    Kinds are "full" (the plain message), "snapshot" (the message with its
+    sequence number) and "delta" (only the fields that changed since the
+    previous tick, keyed by item; removed items map to None).
+    """
+
+    def __init__(self, seq, message, previous=None):
+        self.seq = seq
+        self.message = message
+        self.state = _keyed(message)
+        self._previous = previous
+        self._rendered = {}
+
+    def delta(self):
+        previous = self._previous or {s: {} for s in KEYED_SECTIONS}
+        payload = {"type": "delta", "seq": self.seq}
+        for section in KEYED_SECTIONS:
+            old_rows, changes = previous[section], {}
+            for item, row in self.state[section].items():
+                old = old_rows.get(item)
+                if old is None:
+                    changes[item] = row
+                    continue
+                fields = {k: v for k, v in row.items() if old.get(k) != v}
+                if fields:
+                    changes[item] = fields
+            for item in old_rows.keys() - self.state[section].keys():
+                changes[item] = None
+            if changes:
+                payload[section] = changes
+        if self.state["market_impact"] != previous.get("market_impact"):
+            payload["market_impact"] = self.state["market_impact"]
+        return payload
+
+    def render(self, kind, encoding="json"):
+        key = (kind, encoding)
+        if key not in self._rendered:
+            if kind == "delta":
+                payload = self.delta()
+            elif kind == "snapshot":
+                payload = {"type": "snapshot", "seq": self.seq, **self.message}
+            else:
+                payload = self.message
+            self._rendered[key] = _encode(payload, encoding)
+        return self._rendered[key]
+
+
+class ErrorFrame:
+    """An error reply to one client, outside the topic's sequence numbers"""
+
+    def __init__(self, message):
+        self.message = message
+
+    def render(self, encoding="json"):
+        return _encode({"error": self.message}, encoding)
+
+
+class Subscriber:
+    """A client's bounded view of a topic; the oldest update is dropped when full
+
+    In "delta" mode a client gets a snapshot first and deltas afterwards;
+    any gap in sequence numbers (a dropped frame, a topic switch or a
+    resync request) makes the next frame a snapshot again.
+
+    Error replies go through the same queue, so they are sent in the
+    negotiated encoding and never interleave with an update; when the
+    queue is full an update is dropped in their place.
+    """
+
+    def __init__(self, maxsize=2, mode="full", encoding="json"):
+        self.queue = asyncio.Queue(maxsize)
+        self.mode = mode
+        self.encoding = encoding
+        self.topic = None
+        self.last_seq = None
+        self.delivered = 0
+        self.dropped = 0
+
+    def offer(self, message):
+        if self.queue.full():
+            queued = [self.queue.get_nowait() for _ in range(self.queue.qsize())]
+            drop = next(
+                (i for i, m in enumerate(queued) if not isinstance(m, ErrorFrame)), 0
+            )
+            del queued[drop]
+            for queued_message in queued:
+                self.queue.put_nowait(queued_message)
+            self.dropped += 1
+        self.queue.put_nowait(message)
+        self.delivered += 1
+
+    def error(self, message):
+        self.offer(ErrorFrame(message))
+
+    def clear(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.last_seq = None
+
+    def render(self, frame):
+        """Encoded payload (str or bytes) of a frame for this subscriber"""
+        if isinstance(frame, ErrorFrame):
+            return frame.render(self.encoding)
+        if self.mode == "full":
+            kind = "full"
+        elif self.last_seq is not None and frame.seq == self.last_seq + 1:
+            kind = "delta"
+        else:
+            kind = "snapshot"
+        self.last_seq = frame.seq
+        return frame.render(kind, self.encoding)
+
+
+class SimulationHub:
+    """One scheduled tick per topic, fanned out to every subscriber
+
+    `compute(topic)` is awaited once per tick for each topic that has at
+    least one subscriber, and its result is offered to all of them as a
+    shared `SimulationFrame`, so each encoding is serialized once. A slow
+    subscriber only loses its own oldest updates; it never delays the tick
+    or other subscribers.
+    """
+
+    def __init__(self, compute, tick_interval=1.0, queue_size=2):
+        self.compute = compute
+        self.tick_interval = tick_interval
+        self.queue_size = queue_size
+        self.ticks = 0
+        self.errors = 0
+        self._topics = {}
+
+    def subscribe(self, topic, subscriber=None):
+        """Attach a (new or existing) subscriber to a topic, leaving its old one"""
+        subscriber = subscriber or Subscriber(self.queue_size)
+        if subscriber.topic == topic:
+            return subscriber
+        if subscriber.topic is not None:
+            self.unsubscribe(subscriber)
+            subscriber.clear()
+
+        state = self._topics.get(topic)
+        if state is None:
+            state = {"subscribers": set(), "latest": None, "task": None, "seq": 0}
+            self._topics[topic] = state
+            state["task"] = asyncio.create_task(self._run(topic, state))
+
+        state["subscribers"].add(subscriber)
+        subscriber.topic = topic
+        # Late joiners start from the current state instead of waiting a tick
+        if state["latest"] is not None:
+            subscriber.offer(state["latest"])
+        return subscriber
+
+    def resync(self, subscriber):
+        """Send the subscriber a fresh snapshot of its topic"""
+        subscriber.clear()
+        state = self._topics.get(subscriber.topic)
+        if state is not None and state["latest"] is not None:
+            subscriber.offer(state["latest"])
+
+    def unsubscribe(self, subscriber):
+        state = self._topics.get(subscriber.topic)
+        subscriber.topic = None
+        if state is None:
+            return
+        state["subscribers"].discard(subscriber)
+        if not state["subscribers"]:
+            state["task"].cancel()
+            self._topics = {k: v for k, v in self._topics.items() if v is not state}
+
+    async def _run(self, topic, state):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            try:
+                message = await self.compute(topic)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                print(f"Simulation tick error for {topic}: {e}")
+                message = None
+
+            if message is not None:
+                self.ticks += 1
+                state["seq"] += 1
+                previous = state["latest"]
+                frame = SimulationFrame(
+                    state["seq"], message, previous.state if previous else None
+                )
+                state["latest"] = frame
+                for subscriber in list(state["subscribers"]):
+                    subscriber.offer(frame)
+
+            await asyncio.sleep(max(0.0, self.tick_interval - (loop.time() - started)))
+
+    async def close(self):
+        tasks = [state["task"] for state in self._topics.values()]
+        self._topics = {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "topics": len(self._topics),
+            "subscribers": sum(len(s["subscribers"]) for s in self._topics.values()),
+            "ticks": self.ticks,
+            "errors": self.errors,
+            "tick_interval": self.tick_interval,
+        }
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Columns StockPredictor.prepare_features and train_models actually read
+TRAINING_COLUMNS = ["Item", "Buy Price", "Month", "Market Trend", "Stock in Inventory"]
+
+TRAINING_DTYPES = {
+    "Item": "category",
+    "Buy Price": "float32",
+    "Month": "int16",
+    "Market Trend": "category",
+    "Stock in Inventory": "float32",
+}
+
+DEFAULT_DATA_PATH = os.environ.get(
+    "WAREHOUSE_DATA_PATH", "D:/College/5thsemel/tobolt/project/data1.csv"
+)
+DEFAULT_ROW_LIMIT = int(os.environ.get("WAREHOUSE_DATA_ROWS", "5000")) or None
+
+
+def concat_chunks(chunks):
+    """Concatenate frames while keeping categorical columns categorical"""
+    if not chunks:
+        return pd.DataFrame(
+            {c: pd.Series(dtype=t) for c, t in TRAINING_DTYPES.items()}
+        )
+    if len(chunks) == 1:
+        return chunks[0].reset_index(drop=True)
+
+    combined = {}
+    for column in chunks[0].columns:
+        parts = [chunk[column] for chunk in chunks]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            combined[column] = pd.Series(union_categoricals(parts, ignore_order=True))
+        else:
+            combined[column] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(combined)
+
+
+class CSVDataSource:
+    """Lazily loads the projected training columns from a CSV file"""
+
+    def __init__(
+        self,
+        path=DEFAULT_DATA_PATH,
+        nrows=DEFAULT_ROW_LIMIT,
+        sample_frac=None,
+        chunksize=100_000,
+        random_state=42,
+    ):
+        self.path = path
+        self.nrows = nrows
+        self.sample_frac = sample_frac
+        self.chunksize = chunksize
+        self.random_state = random_state
+        self._data = None
+
+    def fingerprint(self):
+        """Cheap identity of the data this source would load, without reading it"""
+        stat = os.stat(self.path)
+        key = {
+            "path": os.path.abspath(self.path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "nrows": self.nrows,
+            "sample_frac": self.sample_frac,
+            "random_state": self.random_state,
+            "columns": TRAINING_COLUMNS,
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def load(self):
+        """Read the data on first use and cache it"""
+        if self._data is None:
+            self._data = self._read()
+        return self._data
+
+    def _read(self):
+        reader = pd.read_csv(
+            self.path,
+            usecols=TRAINING_COLUMNS,
+            dtype=TRAINING_DTYPES,
+            chunksize=self.chunksize,
+            # Without sampling the row limit lets the parser stop early
+            nrows=None if self.sample_frac else self.nrows,
+        )
+
+        chunks = []
+        remaining = self.nrows
+        for i, chunk in enumerate(reader):
+            if self.sample_frac:
+                chunk = chunk.sample(
+                    frac=self.sample_frac, random_state=self.random_state + i
+                )
+            if remaining is not None:
+                chunk = chunk.iloc[:remaining]
+                remaining -= len(chunk)
+            chunks.append(chunk)
+            if remaining == 0:
+                break
+
+        return concat_chunks(chunks)
+
+
+class FrameDataSource:
+    """Wraps an in-memory DataFrame, e.g. for tests and benchmarks"""
+
+    def __init__(self, frame):
+        self.frame = frame
+
+    def fingerprint(self):
+        digest = hashlib.sha256()
+        digest.update(json.dumps([str(c) for c in self.frame.columns]).encode())
+        digest.update(
+            pd.util.hash_pandas_object(self.frame, index=False).values.tobytes()
+        )
+        return digest.hexdigest()
+
+    def load(self):
+        return self.frame
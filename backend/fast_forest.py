@@ -0,0 +1,152 @@
+import time
+
+import numpy as np
+
+# Upper bound on tree x row cells traversed at once, to cap scratch memory
+MAX_CELLS_PER_CHUNK = 1 << 16
+
+
+class FlatForest:
+    """A fitted RandomForestRegressor compiled into contiguous node tables
+
+    All trees share one set of arrays; `roots` holds each tree's first node
+    and `children[2 * node + went_right]` its successor. Leaves point to
+    themselves, so every tree can be advanced in lockstep for `max_depth`
+    steps with plain NumPy gathers and no per-tree Python calls.
+    """
+
+    def __init__(self, feature, threshold, children, value, roots, max_depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+
+    @classmethod
+    def from_sklearn(cls, forest):
+        features, thresholds, children, values, roots = [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count, dtype=np.int64)
+            is_leaf = tree.children_left == -1
+
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int64))
+            thresholds.append(tree.threshold.astype(np.float64))
+            left = np.where(is_leaf, nodes, tree.children_left) + offset
+            right = np.where(is_leaf, nodes, tree.children_right) + offset
+            children.append(np.column_stack((left, right)).ravel())
+            values.append(tree.value[:, 0, 0].astype(np.float64))
+            roots.append(offset)
+
+            offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            np.concatenate(features),
+            np.concatenate(thresholds),
+            np.concatenate(children).astype(np.int64),
+            np.concatenate(values),
+            np.asarray(roots, dtype=np.int64),
+            max_depth,
+        )
+
+    def arrays(self):
+        """Node tables as a dict of plain arrays, e.g. for persistence"""
+        return {
+            "feature": self.feature,
+            "threshold": self.threshold,
+            "children": self.children,
+            "value": self.value,
+            "roots": self.roots,
+            "max_depth": np.asarray(self.max_depth),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(
+            arrays["feature"],
+            arrays["threshold"],
+            arrays["children"],
+            arrays["value"],
+            arrays["roots"],
+            int(arrays["max_depth"]),
+        )
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def _leaf_values(self, X):
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+        row_offsets = (np.arange(n_rows) * n_features)[np.newaxis, :]
+        nodes = np.repeat(self.roots[:, np.newaxis], n_rows, axis=1)
+        for _ in range(self.max_depth):
+            went_right = (
+                flat_X[row_offsets + self.feature[nodes]] > self.threshold[nodes]
+            )
+            nodes = self.children[2 * nodes + went_right]
+        return self.value[nodes]
+
+    def predict_all(self, X):
+        """Per-tree predictions as a (n_trees, n_rows) matrix"""
+        # sklearn rounds input to float32 before comparing against thresholds
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        chunk = max(1, MAX_CELLS_PER_CHUNK // self.n_trees)
+        if len(X) <= chunk:
+            return self._leaf_values(X)
+        return np.concatenate(
+            [self._leaf_values(X[i : i + chunk]) for i in range(0, len(X), chunk)],
+            axis=1,
+        )
+
+    def predict(self, X):
+        """Forest mean, accumulated tree by tree exactly like sklearn"""
+        per_tree = self.predict_all(X)
+        # Reducing axis 0 of a C-contiguous array adds the rows in order,
+        # matching sklearn's running sum without a second full matrix
+        return per_tree.sum(axis=0) / self.n_trees
+
+
+def benchmark(forest, n_features=4, batch_sizes=(1, 10, 1_000, 100_000), repeats=50):
+    """Compare p50/p99 latency of sklearn and FlatForest predictions"""
+    flat = FlatForest.from_sklearn(forest)
+    rng = np.random.default_rng(0)
+    results = []
+
+    for batch_size in batch_sizes:
+        X = rng.random((batch_size, n_features))
+        runs = max(3, repeats if batch_size <= 1_000 else repeats // 10)
+        row = {"batch_size": batch_size}
+
+        for name, predict in (("sklearn", forest.predict), ("flat", flat.predict)):
+            timings = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                predict(X)
+                timings.append(time.perf_counter() - start)
+            row[f"{name}_p50_ms"] = float(np.percentile(timings, 50)) * 1000
+            row[f"{name}_p99_ms"] = float(np.percentile(timings, 99)) * 1000
+
+        row["identical"] = bool(np.array_equal(forest.predict(X), flat.predict(X)))
+        results.append(row)
+
+    return results
+
+
+if __name__ == "__main__":
+    from model import StockPredictor
+
+    predictor = StockPredictor()
+    print(
+        f"{'batch':>8} {'sk_p50':>9} {'sk_p99':>9} {'flat_p50':>9} "
+        f"{'flat_p99':>9} {'identical':>10}"
+    )
+    for r in benchmark(predictor.rf_model):
+        print(
+            f"{r['batch_size']:>8} {r['sklearn_p50_ms']:>9.3f} {r['sklearn_p99_ms']:>9.3f} "
+            f"{r['flat_p50_ms']:>9.3f} {r['flat_p99_ms']:>9.3f} {str(r['identical']):>10}"
+        )
@@ -0,0 +1,138 @@
+import argparse
+import time
+
+import numpy as np
+
+
+def event_intensity(start, duration, half_life, steps):
+    """(events, steps) intensity of each scheduled event
+
+    An event is fully active for `duration` steps from `start`; afterwards
+    its effect halves every `half_life` steps (0 ends it abruptly).
+    """
+    start = np.asarray(start, dtype=np.float64)[:, None]
+    end = start + np.asarray(duration, dtype=np.float64)[:, None]
+    half_life = np.asarray(half_life, dtype=np.float64)[:, None]
+    t = np.arange(steps, dtype=np.float64)[None, :]
+
+    active = (t >= start) & (t < end)
+    decaying = (t >= end) & (half_life > 0)
+    tail = 0.5 ** ((t - end + 1) / np.where(half_life > 0, half_life, 1.0))
+    return np.where(active, 1.0, np.where(decaying, tail, 0.0))
+
+
+def composed_multiplier(intensity, multipliers):
+    """(steps,) product of each event's multiplier, scaled by its intensity"""
+    multipliers = np.asarray(multipliers, dtype=np.float64)[:, None]
+    return np.prod(1 + intensity * (multipliers - 1), axis=0)
+
+
+class ForwardProjection:
+    """Inventory, price and utilization paths for warehouses x items
+
+    Events and trends act per step and per item, never per warehouse, so
+    stock factors into `initial_stock[w, i] * item_factor[t, i]`. Utilization
+    is then a single matrix product, and the full (steps, warehouses, items)
+    stock cube is only materialized, as float32, when asked for.
+    """
+
+    def __init__(self, initial_stock, item_factor, prices, capacity, intensity):
+        self.initial_stock = initial_stock
+        self.item_factor = item_factor
+        self.prices = prices
+        self.capacity = capacity
+        self.intensity = intensity
+
+    @property
+    def steps(self):
+        return self.item_factor.shape[0]
+
+    def total_stock(self):
+        """(steps, warehouses) projected stock across all items"""
+        return self.item_factor @ self.initial_stock.T
+
+    def utilization(self):
+        """(steps, warehouses) utilization percentage, clipped to 0-100"""
+        return np.clip(self.total_stock() / self.capacity * 100, 0, 100)
+
+    def stock(self, steps=slice(None)):
+        """(steps, warehouses, items) projected stock as float32"""
+        factor = self.item_factor[steps].astype(np.float32)
+        return factor[:, None, :] * self.initial_stock.astype(np.float32)[None, :, :]
+
+
+def project(
+    initial_stock,
+    buy_prices,
+    steps,
+    schedule=None,
+    stock_drift=None,
+    price_drift=None,
+    capacity=1000.0,
+):
+    """Project `initial_stock` (warehouses, items) forward `steps` steps
+
+    `schedule` maps start, duration, half_life, stock_multiplier and
+    price_multiplier to one array entry per scheduled event. Drifts are
+    per-item growth rates per step (e.g. from market trends). `capacity` is
+    a scalar or one value per warehouse.
+    """
+    initial_stock = np.asarray(initial_stock, dtype=np.float64)
+    buy_prices = np.asarray(buy_prices, dtype=np.float64)
+    n_items = initial_stock.shape[1]
+    t = np.arange(steps, dtype=np.float64)[:, None]
+
+    if schedule and len(schedule["start"]):
+        intensity = event_intensity(
+            schedule["start"], schedule["duration"], schedule["half_life"], steps
+        )
+        stock_events = composed_multiplier(intensity, schedule["stock_multiplier"])
+        price_events = composed_multiplier(intensity, schedule["price_multiplier"])
+    else:
+        intensity = np.zeros((0, steps))
+        stock_events = price_events = np.ones(steps)
+
+    stock_drift = np.zeros(n_items) if stock_drift is None else np.asarray(stock_drift)
+    price_drift = np.zeros(n_items) if price_drift is None else np.asarray(price_drift)
+    item_factor = stock_events[:, None] * (1 + stock_drift)[None, :] ** t
+    prices = price_events[:, None] * buy_prices[None, :] * (1 + price_drift)[None, :] ** t
+
+    return ForwardProjection(initial_stock, item_factor, prices, capacity, intensity)
+
+
+def benchmark(steps=365, n_warehouses=1000, n_items=500, n_events=4, seed=0):
+    rng = np.random.default_rng(seed)
+    initial_stock = rng.integers(50, 500, size=(n_warehouses, n_items))
+    buy_prices = rng.uniform(10, 500, n_items)
+    schedule = {
+        "start": rng.integers(0, steps, n_events),
+        "duration": rng.integers(1, 60, n_events),
+        "half_life": rng.uniform(0, 30, n_events),
+        "stock_multiplier": rng.uniform(0.7, 1.3, n_events),
+        "price_multiplier": rng.uniform(0.8, 1.2, n_events),
+    }
+    drift = rng.uniform(-0.002, 0.002, n_items)
+
+    start = time.perf_counter()
+    projection = project(initial_stock, buy_prices, steps, schedule, drift, -drift)
+    utilization = projection.utilization()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{steps} steps x {n_warehouses} warehouses x {n_items} items: "
+        f"projection + utilization {elapsed * 1000:.1f} ms {utilization.shape}"
+    )
+
+    start = time.perf_counter()
+    last = projection.stock(slice(-1, None))
+    elapsed_step = time.perf_counter() - start
+    print(f"One step of the stock cube: {elapsed_step * 1000:.1f} ms {last.shape}")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the forward projection")
+    parser.add_argument("--steps", type=int, default=365)
+    parser.add_argument("--warehouses", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=500)
+    args = parser.parse_args()
+    benchmark(args.steps, args.warehouses, args.items)
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class InferenceQueue:
+    """Coalesces concurrent prediction requests into batched model calls
+
+    Requests arriving within `max_wait_ms` of the first queued one are merged
+    (up to `max_batch_size` rows) into a single call of `predict_batch`,
+    which runs in an executor so the event loop is never blocked by the
+    forest. `predict_batch` takes the four concatenated input lists and
+    returns a dict of per-row arrays; each caller gets its own slice back.
+    """
+
+    def __init__(self, predict_batch, max_batch_size=256, max_wait_ms=5, executor=None):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="inference"
+        )
+        self.batches = 0
+        self.rows = 0
+        self.requests = 0
+        self.last_batch_latency = 0.0
+        self._queue = None
+        self._worker = None
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, items, buy_prices, months, market_trends):
+        """Queue one request and wait for its slice of the batched result"""
+        lengths = {len(items), len(buy_prices), len(months), len(market_trends)}
+        if len(lengths) != 1:
+            # Rows are sliced back by position, so ragged inputs would shift
+            # every later request's results in the same batch
+            raise ValueError("items, buy_prices, months and market_trends must be the same length")
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(
+            (future, (list(items), list(buy_prices), list(months), list(market_trends)))
+        )
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        n_rows = len(batch[0][1][0])
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+
+        while n_rows < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                request = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(request)
+            n_rows += len(request[1][0])
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            inputs = [sum((request[1][i] for request in batch), []) for i in range(4)]
+
+            start = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(
+                    self.executor, self.predict_batch, *inputs
+                )
+            except Exception as e:
+                if len(batch) == 1:
+                    if not batch[0][0].done():
+                        batch[0][0].set_exception(e)
+                else:
+                    # Isolate the failing request so it cannot fail its neighbours
+                    await self._run_individually(loop, batch)
+                continue
+
+            self.last_batch_latency = time.perf_counter() - start
+            self.batches += 1
+            self.requests += len(batch)
+            self.rows += len(inputs[0])
+
+            offset = 0
+            for future, request in batch:
+                n = len(request[0])
+                if not future.done():
+                    future.set_result(
+                        {k: np.asarray(v)[offset : offset + n] for k, v in result.items()}
+                    )
+                offset += n
+
+    async def _run_individually(self, loop, batch):
+        for future, request in batch:
+            try:
+                result = await loop.run_in_executor(
+                    self.executor, self.predict_batch, *request
+                )
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result({k: np.asarray(v) for k, v in result.items()})
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "requests": self.requests,
+            "rows": self.rows,
+            "avg_batch_rows": self.rows / self.batches if self.batches else 0.0,
+            "last_batch_latency_ms": self.last_batch_latency * 1000,
+        }
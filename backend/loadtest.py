@@ -0,0 +1,379 @@
+"""In-process load test for the REST and WebSocket endpoints
+
+    python loadtest.py --output results.json
+    python loadtest.py --output new.json --compare results.json
+
+Runs the ASGI app directly against in-memory storage and a synthetic
+training set. With --compare the exit status is 1 if any endpoint's p95 or
+throughput regressed by more than --threshold.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+HTTP_SCENARIOS = {
+    "GET /sentiment": ("GET", "/sentiment", None),
+    "GET /market-events": ("GET", "/market-events", None),
+    "GET /warehouse-data": ("GET", "/warehouse-data", None),
+    "POST /predict_warehouse": ("POST", "/predict_warehouse", "prediction"),
+    # One catalog item is held out of the training data to exercise the
+    # model's fallback for labels it has never seen
+    "POST /predict_warehouse (unseen item)": (
+        "POST",
+        "/predict_warehouse",
+        "unseen_prediction",
+    ),
+}
+WS_SCENARIO = "WS /ws/simulation"
+
+
+def configure_environment(workdir, tick_seconds):
+    """Point the app at local stand-ins; must run before `app` is imported"""
+    os.environ["STORAGE_BACKEND"] = "memory"
+    os.environ["WAREHOUSE_DATA_PATH"] = os.path.join(workdir, "training.csv")
+    os.environ["MODEL_STORE_DIR"] = os.path.join(workdir, "artifacts")
+    os.environ["SHARED_MODEL_DIR"] = os.path.join(workdir, "shared-model")
+    os.environ["SIMULATION_TICK_SECONDS"] = str(tick_seconds)
+    os.environ.setdefault("WAREHOUSE_CHANGE_STREAM", "0")
+
+
+def write_training_data(path, parts, n_rows=5000, seed=0):
+    """Synthetic training rows for `parts` and every trend the app serves"""
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    trends = sorted({p["trend"] for p in parts.values()} | {"bullish", "bearish"})
+    pd.DataFrame(
+        {
+            "Item": rng.choice(list(parts), n_rows),
+            "Buy Price": rng.uniform(10, 500, n_rows).round(2),
+            "Month": rng.integers(1, 13, n_rows),
+            "Market Trend": rng.choice(trends, n_rows),
+            "Stock in Inventory": rng.integers(50, 500, n_rows),
+        }
+    ).to_csv(path, index=False)
+
+
+class ASGIClient:
+    """Minimal ASGI driver for lifespan, HTTP and WebSocket calls"""
+
+    def __init__(self, app):
+        self.app = app
+        self._lifespan = None
+        self._lifespan_queue = None
+
+    async def startup(self):
+        self._lifespan_queue = asyncio.Queue()
+        started = asyncio.get_running_loop().create_future()
+
+        async def send(message):
+            if message["type"] == "lifespan.startup.complete":
+                started.set_result(None)
+            elif message["type"] == "lifespan.startup.failed":
+                started.set_exception(RuntimeError(message.get("message")))
+
+        scope = {"type": "lifespan", "asgi": {"version": "3.0"}}
+        self._lifespan = asyncio.create_task(
+            self.app(scope, self._lifespan_queue.get, send)
+        )
+        await self._lifespan_queue.put({"type": "lifespan.startup"})
+        await started
+
+    async def shutdown(self):
+        await self._lifespan_queue.put({"type": "lifespan.shutdown"})
+        await self._lifespan
+
+    @staticmethod
+    def _scope(kind, path):
+        url = urlsplit(path)
+        return {
+            "type": kind,
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "scheme": "ws" if kind == "websocket" else "http",
+            "path": url.path,
+            "raw_path": url.path.encode(),
+            "query_string": url.query.encode(),
+            "root_path": "",
+            "headers": [(b"host", b"loadtest")],
+            "client": ("127.0.0.1", 50000),
+            "server": ("loadtest", 80),
+        }
+
+    async def request(self, method, path, body=None):
+        """Returns (status, body bytes)"""
+        scope = self._scope("http", path)
+        scope["method"] = method
+        payload = b""
+        if body is not None:
+            payload = json.dumps(body).encode()
+            scope["headers"].append((b"content-type", b"application/json"))
+        scope["headers"].append((b"content-length", str(len(payload)).encode()))
+
+        disconnected = asyncio.Event()
+        sent = False
+        status, chunks = None, []
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": payload, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    disconnected.set()
+
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+    def websocket(self, path):
+        return WebSocketSession(self.app, self._scope("websocket", path))
+
+
+class WebSocketSession:
+    def __init__(self, app, scope):
+        self.app = app
+        self.scope = scope
+        self._inbound = asyncio.Queue()
+        self._outbound = asyncio.Queue()
+        self._task = None
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(
+            self.app(self.scope, self._inbound.get, self._outbound.put)
+        )
+        await self._inbound.put({"type": "websocket.connect"})
+        message = await self._outbound.get()
+        if message["type"] != "websocket.accept":
+            raise RuntimeError(f"WebSocket rejected: {message}")
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._inbound.put({"type": "websocket.disconnect", "code": 1000})
+        try:
+            await asyncio.wait_for(self._task, 5)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+
+    async def send_json(self, data):
+        await self._inbound.put({"type": "websocket.receive", "text": json.dumps(data)})
+
+    async def receive(self):
+        message = await self._outbound.get()
+        if message["type"] == "websocket.close":
+            raise ConnectionError(f"WebSocket closed with code {message.get('code')}")
+        return message.get("text") or message.get("bytes")
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = np.asarray(latencies) * 1000
+    p50, p95, p99 = (
+        np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0, 0, 0)
+    )
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(latencies.max()), 3) if len(latencies) else 0.0,
+    }
+
+
+def prediction_body(rng, parts, extra_items=()):
+    items = list(rng.choice(list(parts), 5 - len(extra_items))) + list(extra_items)
+    return {
+        "items": items,
+        "buy_prices": [parts[i]["buy_price"] for i in items],
+        "months": [int(m) for m in rng.integers(1, 13, len(items))],
+        "market_trends": [parts[i]["trend"] for i in items],
+        "warehouse_id": str(rng.integers(1, 6)),
+    }
+
+
+async def run_http(client, method, path, body_factory, requests, concurrency):
+    latencies, errors = [], 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            body = body_factory() if body_factory else None
+            start = time.perf_counter()
+            try:
+                status, _ = await client.request(method, path, body)
+                if status >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run_websocket(client, clients, frames, warehouse_ids, events, mode):
+    """Each client subscribes to a topic and times the frames it receives
+
+    Latency is the gap before each frame: subscription to first frame, then
+    frame to frame, so it reflects tick rate plus fan-out delay.
+    """
+    latencies, errors = [], 0
+    rng = np.random.default_rng(1)
+
+    async def session(i):
+        nonlocal errors
+        topic = {
+            "warehouse_id": warehouse_ids[i % len(warehouse_ids)],
+            "market_event": str(rng.choice(events)) if i % 2 else None,
+        }
+        try:
+            async with client.websocket(f"/ws/simulation?mode={mode}") as ws:
+                await ws.send_json(topic)
+                last = time.perf_counter()
+                for _ in range(frames):
+                    await asyncio.wait_for(ws.receive(), 30)
+                    now = time.perf_counter()
+                    latencies.append(now - last)
+                    last = now
+        except Exception:
+            errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(i) for i in range(clients)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run_load_test(args):
+    import app as api
+
+    *trained, unseen = api.AUTOMOTIVE_PARTS
+    trained_parts = {item: api.AUTOMOTIVE_PARTS[item] for item in trained}
+    write_training_data(os.environ["WAREHOUSE_DATA_PATH"], trained_parts)
+    # Train up front so the first measured requests do not pay for it
+    api.warm_stock_predictor()
+
+    client = ASGIClient(api.app)
+    await client.startup()
+    # Startup does not seed market events, so /market-events would be empty
+    await api.events_collection.insert_many(api.market_event_docs())
+    rng = np.random.default_rng(0)
+    bodies = {
+        "prediction": lambda: prediction_body(rng, trained_parts),
+        "unseen_prediction": lambda: prediction_body(
+            rng, api.AUTOMOTIVE_PARTS, [unseen]
+        ),
+    }
+    results = {}
+    try:
+        for name, (method, path, body) in HTTP_SCENARIOS.items():
+            factory = bodies[body] if body else None
+            results[name] = await run_http(
+                client, method, path, factory, args.requests, args.concurrency
+            )
+            print(f"{name:<38} {format_result(results[name])}")
+
+        results[WS_SCENARIO] = await run_websocket(
+            client,
+            args.ws_clients,
+            args.ws_frames,
+            [w["id"] for w in api.WAREHOUSES],
+            list(api.MARKET_EVENTS),
+            args.ws_mode,
+        )
+        print(f"{WS_SCENARIO:<38} {format_result(results[WS_SCENARIO])}")
+    finally:
+        await client.shutdown()
+
+    return {
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "ws_clients": args.ws_clients,
+            "ws_frames": args.ws_frames,
+            "ws_mode": args.ws_mode,
+            "tick_seconds": args.tick_seconds,
+        },
+        "endpoints": results,
+    }
+
+
+def format_result(r):
+    return (
+        f"{r['throughput_rps']:>9.1f} req/s  p50 {r['p50_ms']:>8.2f} ms  "
+        f"p95 {r['p95_ms']:>8.2f} ms  p99 {r['p99_ms']:>8.2f} ms  errors {r['errors']}"
+    )
+
+
+def compare(baseline, current, threshold):
+    """Print per-endpoint changes; returns the endpoints that regressed"""
+    regressions = []
+    print(
+        f"\n{'endpoint':<38} {'p95 base':>9} {'p95 now':>9} "
+        f"{'rps base':>9} {'rps now':>9}"
+    )
+    for name, now in sorted(current["endpoints"].items()):
+        base = baseline["endpoints"].get(name)
+        if base is None:
+            print(f"{name:<38} (new)")
+            continue
+        slower = base["p95_ms"] and now["p95_ms"] > base["p95_ms"] * (1 + threshold)
+        fewer = base["throughput_rps"] and (
+            now["throughput_rps"] < base["throughput_rps"] * (1 - threshold)
+        )
+        flag = "  REGRESSION" if slower or fewer else ""
+        print(
+            f"{name:<38} {base['p95_ms']:>9.2f} {now['p95_ms']:>9.2f} "
+            f"{base['throughput_rps']:>9.1f} {now['throughput_rps']:>9.1f}{flag}"
+        )
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-process API load test")
+    parser.add_argument("--requests", type=int, default=500, help="per HTTP endpoint")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--ws-clients", type=int, default=50)
+    parser.add_argument("--ws-frames", type=int, default=5)
+    parser.add_argument("--ws-mode", choices=["full", "delta"], default="full")
+    parser.add_argument("--tick-seconds", type=float, default=0.1)
+    parser.add_argument("--output", default=None, help="write results JSON here")
+    parser.add_argument("--compare", default=None, help="baseline results JSON")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as workdir:
+        configure_environment(workdir, args.tick_seconds)
+        report = asyncio.run(run_load_test(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.threshold):
+            sys.exit(1)
@@ -3,15 +3,35 @@ import numpy as np
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.preprocessing import LabelEncoder, MinMaxScaler
 from sklearn.model_selection import train_test_split
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.metrics import r2_score
+from sklearn.metrics import mean_absolute_error, r2_score
+from datetime import datetime
+import json
+import time
 import warnings
+from statistics import NormalDist
+
+from data_source import (
+    CSVDataSource,
+    FrameDataSource,
+    TRAINING_COLUMNS,
+    TRAINING_DTYPES,
+    concat_chunks,
+)
+from fast_forest import FlatForest
+from model_store import ModelStore
+from moving_average import MovingAverageIndex
+from prediction_cache import PredictionCache
 
 warnings.filterwarnings("ignore")
 
-# Load dataset
-warehouse_data = pd.read_csv("D:/College/5thsemel/tobolt/project/data1.csv").head(5000)
+FEATURE_NAMES = ["Item", "Buy Price", "Month", "Market Trend"]
+
+# Batches up to this size use the flattened-tree engine; larger ones go
+# through sklearn, whose per-call overhead is amortized by then
+FLAT_ENGINE_MAX_ROWS = 1_000
+
+# Confidence reported for rows whose item or trend the model was not trained on
+UNKNOWN_LABEL_CONFIDENCE = 0.1
 
 # Market events dictionary
 MARKET_EVENTS = {
@@ -84,16 +104,121 @@ MARKET_EVENTS = {
 
 
 class StockPredictor:
-    def __init__(self, window_size=10):
+    def __init__(
+        self,
+        window_size=10,
+        n_estimators=100,
+        max_depth=10,
+        rf_weight=0.7,
+        n_jobs=None,
+        store=None,
+        data_source=None,
+        cache=None,
+    ):
         self.window_size = window_size
+        self.n_estimators = n_estimators
+        self.max_depth = max_depth
+        self.rf_weight = rf_weight
+        self.n_jobs = n_jobs
         self.rf_model = RandomForestRegressor(
-            n_estimators=100, max_depth=10, random_state=42
+            n_estimators=n_estimators,
+            max_depth=max_depth,
+            random_state=42,
+            n_jobs=n_jobs,
         )
         self.scaler = MinMaxScaler()
         self.le_item = LabelEncoder()
         self.le_trend = LabelEncoder()
-        self.data = warehouse_data
-        self.train_models()
+        self.data_source = data_source if data_source is not None else CSVDataSource()
+        # Store keys of the rows added by partial_fit, oldest first
+        self.appended_chunks = []
+        self._data = None
+        self.store = store if store is not None else ModelStore()
+        self.cache = cache if cache is not None else PredictionCache()
+        # Bumped whenever fitted state changes; invalidates cached predictions
+        self.generation = 0
+        # Training-time feature matrix and predictions, reused by evaluate()
+        self.features = None
+        self.target = None
+        # Training target mean and std, the fallback for unknown labels
+        self.target_mean = 0.0
+        self.target_std = 0.0
+        self.fitted_predictions = None
+        self.timings = {}
+        self.engine = None
+
+        # Reuse a previously fitted model when data and params are unchanged,
+        # including any partial_fit updates made on top of it
+        self.base_fingerprint = self.store.fingerprint(
+            self.data_source.fingerprint(), self.hyperparameters()
+        )
+        self.fingerprint = (
+            self.store.head(self.base_fingerprint) or self.base_fingerprint
+        )
+        if not self.load_artifact() and self.fingerprint != self.base_fingerprint:
+            self.fingerprint = self.base_fingerprint
+            self.load_artifact()
+        if self.engine is None:
+            self.train_models()
+            self.save_artifact()
+
+    @property
+    def data(self):
+        """Training data plus appended rows, assembled once on first use"""
+        if self._data is None:
+            chunks = [self.store.load_chunk(key) for key in self.appended_chunks]
+            base = self.data_source.load()
+            self._data = concat_chunks([base, *chunks]) if chunks else base
+        return self._data
+
+    def hyperparameters(self):
+        """Parameters that determine the fitted state"""
+        return {
+            "window_size": self.window_size,
+            "n_estimators": self.n_estimators,
+            "max_depth": self.max_depth,
+            "random_state": 42,
+        }
+
+    def load_artifact(self):
+        """Restore fitted state from the model store, if present"""
+        artifact = self.store.load(self.fingerprint)
+        if artifact is None:
+            return False
+
+        self.rf_model = artifact["rf_model"]
+        self.rf_model.set_params(n_jobs=self.n_jobs)
+        self.scaler = artifact["scaler"]
+        self.le_item = artifact["le_item"]
+        self.le_trend = artifact["le_trend"]
+        # Copied because observe() and partial_fit() update it in place
+        self.item_mas = artifact["item_mas"].copy()
+        self.appended_chunks = list(artifact["appended_chunks"])
+        self._data = None
+        self.target_mean, self.target_std = artifact["target_stats"]
+        self.compile_engine()
+        return True
+
+    def save_artifact(self):
+        """Persist fitted state to the model store"""
+        try:
+            self.store.save(
+                self.fingerprint,
+                {
+                    "params": self.hyperparameters(),
+                    "rf_model": self.rf_model,
+                    "scaler": self.scaler,
+                    "le_item": self.le_item,
+                    "le_trend": self.le_trend,
+                    "item_mas": self.item_mas,
+                    "appended_chunks": self.appended_chunks,
+                    "target_stats": (self.target_mean, self.target_std),
+                },
+            )
+            if self.fingerprint != self.base_fingerprint:
+                self.store.set_head(self.base_fingerprint, self.fingerprint)
+        except OSError as e:
+            print(f"Error saving model artifact: {e}")
 
     def calculate_moving_average(self, series):
         """Calculate simple moving average"""
@@ -102,7 +227,9 @@ class StockPredictor:
     def prepare_features(self, df):
         """Prepare features for model training"""
         df["Item_Encoded"] = self.le_item.fit_transform(df["Item"])
-        df["Market_Trend_Encoded"] = self.le_trend.fit_transform(df["Market Trend"])
+        df["Market_Trend_Encoded"] = self.le_trend.fit_transform(
+            normalize_trends(df["Market Trend"])
+        )
 
         features = np.column_stack(
             (
@@ -115,13 +242,35 @@ class StockPredictor:
 
         return self.scaler.fit_transform(features)
 
+    def transform_features(self, df):
+        """Encode and scale features with the already fitted transformers"""
+        df["Item_Encoded"] = self.le_item.transform(df["Item"])
+        df["Market_Trend_Encoded"] = self.le_trend.transform(
+            normalize_trends(df["Market Trend"])
+        )
+
+        features = np.column_stack(
+            (
+                df["Item_Encoded"],
+                df["Buy Price"],
+                df["Month"],
+                df["Market_Trend_Encoded"],
+            )
+        )
+
+        return self.scaler.transform(features)
+
     def train_models(self):
         """Train the prediction models"""
         df = pd.DataFrame(self.data)
 
         # Prepare features
+        start = time.perf_counter()
         features = self.prepare_features(df)
         target = df["Stock in Inventory"].values
+        self.target_mean = float(target.mean())
+        self.target_std = float(target.std())
+        self.timings["transform_s"] = time.perf_counter() - start
 
         # Split data
         X_train, X_test, y_train, y_test = train_test_split(
@@ -129,50 +278,311 @@ class StockPredictor:
         )
 
         # Train Random Forest
+        start = time.perf_counter()
         self.rf_model.fit(X_train, y_train)
+        self.timings["train_s"] = time.perf_counter() - start
+
+        # Keep the feature pass and its predictions for evaluation
+        start = time.perf_counter()
+        self.fitted_predictions = self.rf_model.predict(features)
+        self.timings["predict_s"] = time.perf_counter() - start
+        self.features = features
+        self.target = target
+
+        # Moving averages for every item, indexed by encoded item id
+        self.item_mas = MovingAverageIndex.from_observations(
+            df["Item_Encoded"].values,
+            target,
+            len(self.le_item.classes_),
+            self.window_size,
+        )
+        self.compile_engine()
+
+    def compile_engine(self):
+        """Flatten the fitted forest for low-latency inference"""
+        self.engine = FlatForest.from_sklearn(self.rf_model)
+        self.generation += 1
+
+    def observe(self, items, stocks):
+        """Fold newly observed stock levels into the moving averages"""
+        codes = encode_labels(self.le_item, items)
+        known = codes >= 0
+        self.item_mas.update_many(codes[known], np.asarray(stocks)[known])
+        self.generation += 1
+
+    def partial_fit(self, new_data, n_new_trees=10, max_trees=None):
+        """Update the fitted model with newly arrived rows
+
+        Adds `n_new_trees` trees trained only on `new_data` and, when
+        `max_trees` is set, retires the oldest trees beyond that count.
+        """
+        df = pd.DataFrame(new_data)[TRAINING_COLUMNS].astype(TRAINING_DTYPES)
+
+        # Chained from the previous fingerprint so only the new rows are
+        # hashed. They are stored on their own, before any state changes, and
+        # the artifact lists their keys, so old rows are never rewritten.
+        fingerprint = self.store.fingerprint(
+            {"previous": self.fingerprint, "rows": FrameDataSource(df).fingerprint()},
+            self.hyperparameters(),
+        )
+        self.store.save_chunk(fingerprint, df)
 
-        # Calculate moving averages for each item
-        self.item_mas = {}
-        for item in df["Item"].unique():
-            item_data = df[df["Item"] == item]["Stock in Inventory"]
-            self.item_mas[item] = self.calculate_moving_average(item_data)
+        # Unseen labels get new codes; existing codes stay valid for old trees
+        extend_label_encoder(self.le_item, df["Item"])
+        extend_label_encoder(self.le_trend, normalize_trends(df["Market Trend"]))
 
-    def predict(self, items, buy_prices, months, market_trends):
-        """Make predictions using ensemble approach"""
-        # Prepare input data
-        items_encoded = self.le_item.transform(items)
-        trends_encoded = self.le_trend.transform(market_trends)
+        # The scaler stays frozen so the existing trees' thresholds keep
+        # their meaning; values outside the fitted range extrapolate.
+        features = self.transform_features(df)
+        target = df["Stock in Inventory"].values
 
-        input_data = np.column_stack(
-            (items_encoded, buy_prices, months, trends_encoded)
+        self.rf_model.set_params(
+            warm_start=True,
+            n_estimators=len(self.rf_model.estimators_) + n_new_trees,
         )
+        self.rf_model.fit(features, target)
+        self.rf_model.set_params(warm_start=False)
+
+        if max_trees is not None and len(self.rf_model.estimators_) > max_trees:
+            self.rf_model.estimators_ = self.rf_model.estimators_[-max_trees:]
+            self.rf_model.set_params(n_estimators=max_trees)
+
+        self.item_mas.update_many(df["Item_Encoded"].values, target)
+        self.compile_engine()
+
+        # The forest and data changed, so cached evaluation state is stale
+        self.features = None
+        self.fitted_predictions = None
+        self._data = None
+
+        self.fingerprint = fingerprint
+        self.appended_chunks.append(fingerprint)
+        self.save_artifact()
+
+    def encode_inputs(self, items, buy_prices, months, market_trends):
+        """Build the unscaled feature rows for raw prediction inputs
+
+        Items and trends the encoders have not seen are encoded as -1.
+        """
+        items_encoded = encode_labels(self.le_item, items)
+        trends_encoded = encode_labels(self.le_trend, normalize_trends(market_trends))
+        if self.cache is not None:
+            buy_prices = self.cache.bucket_prices(buy_prices)
+
+        return np.column_stack((items_encoded, buy_prices, months, trends_encoded))
+
+    def predict_encoded(self, input_data):
+        """Ensemble predictions for already encoded feature rows"""
+        known = known_rows(input_data)
+        if not known.all():
+            predictions = self.fallback_predictions(input_data)
+            if known.any():
+                predictions[known] = self.predict_encoded(input_data[known])
+            return predictions
 
         # Scale input
         scaled_input = self.scaler.transform(input_data)
 
         # RF prediction
-        rf_predictions = self.rf_model.predict(scaled_input)
-
-        # MA predictions
-        ma_predictions = np.zeros(len(items))
-        for i, item in enumerate(items):
-            if item in self.item_mas:
-                ma_predictions[i] = self.item_mas[item].iloc[-1]
-            else:
-                ma_predictions[i] = rf_predictions[i]
+        rf_predictions = self.forest_predictions(scaled_input)
 
         # Ensemble predictions (weighted average)
-        final_predictions = 0.7 * rf_predictions + 0.3 * ma_predictions
+        ma_predictions = self.moving_average_predictions(input_data, rf_predictions)
+        return self.rf_weight * rf_predictions + (1 - self.rf_weight) * ma_predictions
+
+    def forest_predictions(self, scaled_input):
+        """RF predictions; the flattened engine unless the batch is large"""
+        if len(scaled_input) <= FLAT_ENGINE_MAX_ROWS:
+            return self.engine.predict(scaled_input)
+        return self.rf_model.predict(scaled_input)
+
+    def moving_average_predictions(self, input_data, rf_predictions):
+        """MA predictions, falling back to RF for items without history"""
+        ma_predictions = self.item_mas.gather(input_data[:, 0].astype(np.int64))
+        return np.where(np.isnan(ma_predictions), rf_predictions, ma_predictions)
+
+    def fallback_predictions(self, input_data):
+        """Item moving average, else the training mean, for rows with unknown labels"""
+        codes = input_data[:, 0].astype(np.int64)
+        predictions = np.full(len(codes), self.target_mean)
+        item_known = codes >= 0
+        if item_known.any():
+            ma_predictions = self.item_mas.gather(codes[item_known])
+            predictions[item_known] = np.where(
+                np.isnan(ma_predictions), self.target_mean, ma_predictions
+            )
+        return predictions
+
+    def predict_distribution(
+        self, items, buy_prices, months, market_trends, quantiles=(0.1, 0.9)
+    ):
+        """Ensemble predictions with spread from the per-tree predictions
+
+        Mean, standard deviation, quantiles and a confidence score in (0, 1]
+        are all derived from one (n_trees, n_rows) matrix, i.e. a single
+        forest traversal. Rows with an unknown item or trend get the
+        fallback prediction, the training spread and a low confidence.
+        """
+        input_data = self.encode_inputs(items, buy_prices, months, market_trends)
+        return self.distribution_encoded(input_data, quantiles)
+
+    def distribution_encoded(self, input_data, quantiles=(0.1, 0.9)):
+        """predict_distribution for already encoded feature rows"""
+        known = known_rows(input_data)
+        if not known.all():
+            mean = self.fallback_predictions(input_data)
+            std = np.full(len(mean), self.target_std)
+            result = {
+                "mean": mean,
+                "std": std,
+                "quantiles": {
+                    q: mean + NormalDist().inv_cdf(q) * std for q in quantiles
+                },
+                "confidence": np.full(len(mean), UNKNOWN_LABEL_CONFIDENCE),
+            }
+            if known.any():
+                partial = self.distribution_encoded(input_data[known], quantiles)
+                for key in ("mean", "std", "confidence"):
+                    result[key][known] = partial[key]
+                for q in quantiles:
+                    result["quantiles"][q][known] = partial["quantiles"][q]
+            return result
+
+        per_tree = self.engine.predict_all(self.scaler.transform(input_data))
+        # Row-ordered sum, bit-identical to the forest's own mean
+        rf_predictions = per_tree.sum(axis=0) / len(per_tree)
+        ma_predictions = self.moving_average_predictions(input_data, rf_predictions)
+
+        # The MA term is a constant shift per row, so only the RF share spreads
+        per_tree_ensemble = (
+            self.rf_weight * per_tree + (1 - self.rf_weight) * ma_predictions
+        )
+        mean = self.rf_weight * rf_predictions + (1 - self.rf_weight) * ma_predictions
+        std = self.rf_weight * per_tree.std(axis=0)
+        confidence = 1 / (1 + std / np.maximum(np.abs(mean), 1.0))
 
-        return final_predictions.tolist()
+        return {
+            "mean": mean,
+            "std": std,
+            "quantiles": dict(
+                zip(quantiles, np.quantile(per_tree_ensemble, quantiles, axis=0))
+            ),
+            "confidence": confidence,
+        }
+
+    def predict_with_confidence(self, items, buy_prices, months, market_trends):
+        """Ensemble mean and confidence per row, cached like predict()"""
+        input_data = self.encode_inputs(items, buy_prices, months, market_trends)
+        if self.cache is None:
+            distribution = self.distribution_encoded(input_data)
+            return {
+                "mean": distribution["mean"],
+                "confidence": distribution["confidence"],
+            }
+
+        # Tagged so these entries never collide with predict()'s plain means
+        self.cache.sync(self.generation)
+        keys = [("confidence", *row) for row in input_data.tolist()]
+        values, missing = self.cache.get_many(keys, width=2)
+        if missing.any():
+            distribution = self.distribution_encoded(input_data[missing])
+            values[missing] = np.column_stack(
+                (distribution["mean"], distribution["confidence"])
+            )
+            self.cache.put_many(
+                [key for key, miss in zip(keys, missing) if miss], values[missing]
+            )
+
+        return {"mean": values[:, 0], "confidence": values[:, 1]}
+
+    def predict(self, items, buy_prices, months, market_trends):
+        """Make predictions using ensemble approach"""
+        input_data = self.encode_inputs(items, buy_prices, months, market_trends)
+        if self.cache is None:
+            return self.predict_encoded(input_data).tolist()
+
+        # Only cache misses go through the forest
+        self.cache.sync(self.generation)
+        keys = [tuple(row) for row in input_data.tolist()]
+        predictions, missing = self.cache.get_many(keys)
+        if missing.any():
+            predictions[missing] = self.predict_encoded(input_data[missing])
+            self.cache.put_many(
+                [key for key, miss in zip(keys, missing) if miss],
+                predictions[missing],
+            )
+
+        return predictions.tolist()
+
+    def evaluation_arrays(self):
+        """Feature matrix, target and predictions, computed at most once"""
+        if self.features is None:
+            # Loaded from an artifact or updated since training: transform only
+            df = pd.DataFrame(self.data)
+            start = time.perf_counter()
+            self.features = self.transform_features(df)
+            self.target = df["Stock in Inventory"].values
+            self.timings["transform_s"] = time.perf_counter() - start
+
+        if self.fitted_predictions is None:
+            start = time.perf_counter()
+            self.fitted_predictions = self.rf_model.predict(self.features)
+            self.timings["predict_s"] = time.perf_counter() - start
+
+        return self.features, self.target, self.fitted_predictions
+
+    def evaluate(self, report_path=None):
+        """Headless performance report, optionally written as JSON"""
+        features, actual, predicted = self.evaluation_arrays()
+
+        # Per-item MAE from the encoded item column
+        codes = np.rint(
+            (features[:, 0] - self.scaler.min_[0]) / self.scaler.scale_[0]
+        ).astype(np.int64)
+        errors = np.abs(actual - predicted)
+        counts = np.bincount(codes, minlength=len(self.le_item.classes_))
+        error_sums = np.bincount(
+            codes, weights=errors, minlength=len(self.le_item.classes_)
+        )
+        per_item_mae = {
+            str(item): float(error_sums[i] / counts[i])
+            for i, item in enumerate(self.le_item.classes_)
+            if counts[i]
+        }
+
+        report = {
+            "generated_at": datetime.now().isoformat(),
+            "fingerprint": self.fingerprint,
+            "params": self.hyperparameters(),
+            "n_rows": int(len(actual)),
+            "n_trees": len(self.rf_model.estimators_),
+            "r2": float(r2_score(actual, predicted)),
+            "mae": float(mean_absolute_error(actual, predicted)),
+            "per_item_mae": per_item_mae,
+            "feature_importances": dict(
+                zip(FEATURE_NAMES, self.rf_model.feature_importances_.tolist())
+            ),
+            "timings": dict(self.timings),
+        }
+
+        if report_path:
+            with open(report_path, "w") as f:
+                json.dump(report, f, indent=2)
+
+        return report
 
     def visualize_model_performance(self):
         """Generate visualization plots for model performance"""
+        # Plotting stack is only needed here
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
         # Prepare data
         df = pd.DataFrame(self.data)
-        features = self.prepare_features(df)
-        actual = df["Stock in Inventory"].values
-        predicted = self.rf_model.predict(features)
+        _, actual, predicted = self.evaluation_arrays()
 
         # Create a figure with subplots
         fig = plt.figure(figsize=(15, 10))
@@ -191,7 +601,7 @@ class StockPredictor:
         plt.subplot(2, 2, 2)
         feature_importance = pd.DataFrame(
             {
-                "feature": ["Item", "Buy Price", "Month", "Market Trend"],
+                "feature": FEATURE_NAMES,
                 "importance": self.rf_model.feature_importances_,
             }
         )
@@ -203,7 +613,11 @@ class StockPredictor:
         sample_item = df["Item"].unique()[0]
         item_data = df[df["Item"] == sample_item]
         plt.plot(item_data.index, item_data["Stock in Inventory"], label="Actual")
-        plt.plot(item_data.index, self.item_mas[sample_item], label="Moving Average")
+        plt.plot(
+            item_data.index,
+            self.calculate_moving_average(item_data["Stock in Inventory"]),
+            label="Moving Average",
+        )
         plt.title(f"Stock Timeline for {sample_item}")
         plt.legend()
 
@@ -219,10 +633,44 @@ class StockPredictor:
         plt.close()
 
 
+def normalize_trends(values):
+    """Lowercase and strip market trends so "Bullish" and "bullish" match"""
+    return np.array([str(v).strip().lower() for v in values], dtype=object)
+
+
+def encode_labels(encoder, values):
+    """Encode labels with a fitted encoder, mapping unseen ones to -1"""
+    values = np.asarray(values, dtype=object)
+    codes = np.full(len(values), -1, dtype=np.int64)
+    known = np.isin(values, encoder.classes_)
+    if known.any():
+        codes[known] = encoder.transform(values[known])
+    return codes
+
+
+def known_rows(input_data):
+    """Mask of encoded rows whose item and trend were both seen in training"""
+    return (input_data[:, 0] >= 0) & (input_data[:, 3] >= 0)
+
+
+def extend_label_encoder(encoder, values):
+    """Append unseen labels to a fitted LabelEncoder without renumbering"""
+    known = set(encoder.classes_.tolist())
+    unseen = sorted(set(np.asarray(values, dtype=object).tolist()) - known)
+    if unseen:
+        encoder.classes_ = np.concatenate(
+            [encoder.classes_.astype(object), np.array(unseen, dtype=object)]
+        )
+    return unseen
+
+
 class WarehousePredictor:
-    def __init__(self):
-        self.model = StockPredictor()
-        self.data = warehouse_data
+    def __init__(self, data_source=None):
+        self.model = StockPredictor(data_source=data_source)
+
+    @property
+    def data(self):
+        return self.model.data
 
     def predict_real_time(self, items, buy_prices, months, market_trends, event=None):
         """Make real-time predictions with market event impacts"""
@@ -273,6 +721,12 @@ class MarketEventPredictor:
 
 
 if __name__ == "__main__":
+    import sys
+
     predictor = WarehousePredictor()
-    predictor.model.visualize_model_performance()
-    print("Model initialized and performance plots generated successfully")
+    predictor.model.evaluate("model_report.json")
+    if "--headless" in sys.argv:
+        print("Model initialized and report written to model_report.json")
+    else:
+        predictor.model.visualize_model_performance()
+        print("Model initialized and performance plots generated successfully")
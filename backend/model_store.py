@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+
+import joblib
+import sklearn
+
+# Bump whenever the layout of the saved artifact changes so stale files are
+# retrained instead of loaded.
+ARTIFACT_VERSION = 5
+
+DEFAULT_STORE_DIR = os.environ.get(
+    "MODEL_STORE_DIR", os.path.join(os.path.dirname(__file__), "artifacts")
+)
+
+
+class ModelStore:
+    """Versioned on-disk store for fitted StockPredictor state"""
+
+    def __init__(self, directory=DEFAULT_STORE_DIR, mmap_mode="r"):
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+
+    def fingerprint(self, data_key, params):
+        """Combine the data source identity and hyperparameters into an artifact key"""
+        key = {
+            "artifact_version": ARTIFACT_VERSION,
+            "sklearn": sklearn.__version__,
+            "data": data_key,
+            "params": params,
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def path_for(self, fingerprint):
+        return os.path.join(self.directory, f"stock_predictor-{fingerprint[:16]}.joblib")
+
+    def load(self, fingerprint):
+        """Return the stored artifact for a fingerprint, or None on a miss"""
+        path = self.path_for(fingerprint)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            artifact = joblib.load(path, mmap_mode=self.mmap_mode)
+        except Exception as e:
+            print(f"Error loading model artifact {path}: {e}")
+            return None
+
+        if (
+            artifact.get("version") != ARTIFACT_VERSION
+            or artifact.get("fingerprint") != fingerprint
+        ):
+            return None
+        return artifact
+
+    def head_path_for(self, base_fingerprint):
+        return os.path.join(self.directory, f"stock_predictor-{base_fingerprint[:16]}.head")
+
+    def head(self, base_fingerprint):
+        """Latest incrementally updated fingerprint derived from a base, if any"""
+        try:
+            with open(self.head_path_for(base_fingerprint)) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def set_head(self, base_fingerprint, fingerprint):
+        """Record `fingerprint` as the latest state derived from a base"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.head_path_for(base_fingerprint)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(fingerprint)
+        os.replace(tmp_path, path)
+
+    def chunk_path_for(self, key):
+        return os.path.join(self.directory, f"stock_predictor-{key[:16]}.rows.joblib")
+
+    def save_chunk(self, key, frame):
+        """Atomically write one chunk of appended training rows"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.chunk_path_for(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        joblib.dump(frame, tmp_path)
+        os.replace(tmp_path, path)
+        return path
+
+    def load_chunk(self, key):
+        return joblib.load(self.chunk_path_for(key))
+
+    def save(self, fingerprint, state):
+        """Atomically write fitted state under its fingerprint"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(fingerprint)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+
+        artifact = {"version": ARTIFACT_VERSION, "fingerprint": fingerprint, **state}
+        # Uncompressed so numpy arrays can be memory-mapped on load
+        joblib.dump(artifact, tmp_path)
+        os.replace(tmp_path, path)
+        return path
@@ -0,0 +1,338 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+DEFAULT_PERCENTILES = (5, 50, 95)
+
+
+def _histogram(values, lo, width, bins):
+    """(warehouses, items, bins) counts of `values` (paths, warehouses, items)
+
+    Values outside a cell's range are counted in its first or last bin.
+    """
+    index = np.clip(((values - lo) / width).astype(np.int64), 0, bins - 1)
+    cells = np.arange(lo.size).reshape(lo.shape)
+    counts = np.bincount((cells * bins + index).ravel(), minlength=lo.size * bins)
+    return counts.reshape(lo.shape + (bins,)).astype(np.int32)
+
+
+def _simulate_shard(
+    seed,
+    n_paths,
+    initial_stock,
+    daily_demand,
+    supply_multipliers,
+    probabilities,
+    steps,
+    duration_range,
+    demand_sigma,
+    lo,
+    width,
+    bins,
+):
+    """Simulate `n_paths` event paths; returns stockout counts and histograms
+
+    Each event strikes with its probability at a uniform start step, for a
+    uniform duration, with a severity (mean 1) scaling how far it moves
+    replenishment from normal. Replenishment runs at the expected demand
+    times the active events' supply multipliers; realized demand is
+    lognormal around its expectation. Shortfalls are backordered, so stock
+    can go negative and any level <= 0 is a stockout.
+
+    Only per-cell counts leave the worker: paths that stocked out, and
+    fixed-bin histograms of the final and minimum stock levels.
+    """
+    rng = np.random.default_rng(seed)
+    n_events = len(supply_multipliers)
+    t = np.arange(steps)
+
+    occurs = rng.random((n_paths, n_events)) < probabilities
+    start = rng.integers(0, steps, (n_paths, n_events))
+    duration = rng.integers(duration_range[0], duration_range[1] + 1, (n_paths, n_events))
+    severity = rng.beta(2.0, 2.0, (n_paths, n_events)) * 2
+    factor = np.maximum(0.0, 1 + severity * (np.asarray(supply_multipliers) - 1))
+
+    active = (
+        occurs[:, :, None]
+        & (t >= start[:, :, None])
+        & (t < (start + duration)[:, :, None])
+    )
+    # (paths, steps) combined supply multiplier of all active events
+    supply = np.prod(np.where(active, factor[:, :, None], 1.0), axis=1)
+
+    level = np.broadcast_to(initial_stock, (n_paths,) + initial_stock.shape).copy()
+    minimum = level.copy()
+    for step in range(steps):
+        noise = np.exp(
+            demand_sigma * rng.standard_normal(level.shape) - demand_sigma**2 / 2
+        )
+        level += daily_demand * (supply[:, step, None, None] - noise)
+        np.minimum(minimum, level, out=minimum)
+
+    return {
+        "paths": n_paths,
+        "stockouts": (minimum <= 0).sum(axis=0),
+        "final": _histogram(level, lo, width, bins),
+        "minimum": _histogram(minimum, lo, width, bins),
+    }
+
+
+def stock_range(initial_stock, daily_demand, supply_multipliers, steps, demand_sigma):
+    """(lo, hi) per cell bounding where stock levels can plausibly end up
+
+    Stock falls by at most the realized demand (supply stops entirely) and
+    rises by at most the largest combined supply boost; four standard
+    deviations of the summed demand noise are added on both sides.
+    """
+    # Severity is at most 2, so an event scales supply by at most 2m - 1
+    boost = np.prod(np.maximum(1.0, 2 * np.asarray(supply_multipliers) - 1))
+    spread = 4 * daily_demand * np.sqrt(steps * np.expm1(demand_sigma**2))
+    lo = initial_stock - steps * daily_demand - spread
+    hi = initial_stock + steps * daily_demand * (boost - 1) + spread
+    return lo, hi
+
+
+def plan_shards(n_paths, shard_paths, seed, max_shards=None):
+    """(seed, n_paths) per shard; child seeds make runs reproducible per seed
+
+    With `max_shards`, shards grow beyond `shard_paths` as needed to keep
+    their number bounded.
+    """
+    if max_shards:
+        shard_paths = max(shard_paths, -(-n_paths // max_shards))
+    sizes = [shard_paths] * (n_paths // shard_paths)
+    if n_paths % shard_paths:
+        sizes.append(n_paths % shard_paths)
+    return list(zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes))
+
+
+def histogram_percentiles(counts, lo, width, percentiles):
+    """Percentiles per cell from (..., bins) counts, interpolated within bins"""
+    bins = counts.shape[-1]
+    cumulative = np.cumsum(counts, axis=-1)
+    total = cumulative[..., -1]
+    result = []
+    for p in percentiles:
+        target = total * (p / 100)
+        # First bin whose cumulative count reaches the target
+        index = np.minimum((cumulative < target[..., None]).sum(axis=-1), bins - 1)
+        in_bin = np.take_along_axis(counts, index[..., None], axis=-1)[..., 0]
+        reached = np.take_along_axis(cumulative, index[..., None], axis=-1)[..., 0]
+        before = reached - in_bin
+        fraction = np.divide(
+            target - before,
+            in_bin,
+            out=np.zeros(target.shape),
+            where=in_bin > 0,
+        )
+        result.append(lo + (index + np.clip(fraction, 0, 1)) * width)
+    return np.stack(result)
+
+
+class ScenarioReducer:
+    """Merges shard counts into percentiles and stockout probabilities
+
+    Shards only contribute integer counts, which are summed as they
+    arrive, so the summary depends on the seed alone, not on which worker
+    finished first, and costs the same however many paths are done.
+    Percentiles are resolved to within one histogram bin.
+    """
+
+    def __init__(self, total_paths, lo, width, bins, percentiles=DEFAULT_PERCENTILES):
+        self.total_paths = total_paths
+        self.lo = lo
+        self.width = width
+        self.percentiles = percentiles
+        self.paths = 0
+        self.stockouts = np.zeros(lo.shape, dtype=np.int64)
+        self.final = np.zeros(lo.shape + (bins,), dtype=np.int64)
+        self.minimum = np.zeros(lo.shape + (bins,), dtype=np.int64)
+
+    def add(self, *results):
+        for result in results:
+            self.paths += result["paths"]
+            self.stockouts += result["stockouts"]
+            self.final += result["final"]
+            self.minimum += result["minimum"]
+
+    def summary(self):
+        final_pct = histogram_percentiles(
+            self.final, self.lo, self.width, self.percentiles
+        )
+        minimum_pct = histogram_percentiles(
+            self.minimum, self.lo, self.width, self.percentiles
+        )
+        return {
+            "paths": self.paths,
+            "total_paths": self.total_paths,
+            "done": self.paths == self.total_paths,
+            "stockout_probability": self.stockouts / max(self.paths, 1),
+            "final_stock": {f"p{p:g}": v for p, v in zip(self.percentiles, final_pct)},
+            "min_stock": {f"p{p:g}": v for p, v in zip(self.percentiles, minimum_pct)},
+        }
+
+
+class MonteCarloEngine:
+    """Shards scenario paths across a process pool and streams summaries
+
+    Workers are started with "spawn" so they never inherit the server's
+    threads or database connections. At most `max_shards` shards are
+    planned per run, and partial summaries are emitted at most every
+    `summary_interval` seconds; the final one always is.
+    """
+
+    def __init__(
+        self,
+        max_workers=None,
+        shard_paths=500,
+        max_shards=64,
+        bins=512,
+        summary_interval=0.25,
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.shard_paths = shard_paths
+        self.max_shards = max_shards
+        self.bins = bins
+        self.summary_interval = summary_interval
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def submit(
+        self,
+        initial_stock,
+        daily_demand,
+        supply_multipliers,
+        probabilities,
+        n_paths=2000,
+        steps=90,
+        seed=None,
+        duration_range=(3, 30),
+        demand_sigma=0.3,
+        percentiles=DEFAULT_PERCENTILES,
+    ):
+        """Start every shard; returns the run's reducer and shard futures"""
+        initial_stock = np.asarray(initial_stock, dtype=np.float64)
+        daily_demand = np.asarray(daily_demand, dtype=np.float64)
+        supply_multipliers = np.asarray(supply_multipliers, dtype=np.float64)
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+
+        lo, hi = stock_range(
+            initial_stock, daily_demand, supply_multipliers, steps, demand_sigma
+        )
+        width = np.maximum((hi - lo) / self.bins, 1e-9)
+        reducer = ScenarioReducer(n_paths, lo, width, self.bins, percentiles)
+        futures = [
+            self.executor.submit(
+                _simulate_shard,
+                shard_seed,
+                size,
+                initial_stock,
+                daily_demand,
+                supply_multipliers,
+                probabilities,
+                steps,
+                duration_range,
+                demand_sigma,
+                lo,
+                width,
+                self.bins,
+            )
+            for shard_seed, size in plan_shards(
+                n_paths, self.shard_paths, seed, self.max_shards
+            )
+        ]
+        return reducer, futures
+
+    def run(self, *args, **kwargs):
+        """Yield throttled summaries as shards finish; the last one is final"""
+        reducer, futures = self.submit(*args, **kwargs)
+        emitted_at = time.monotonic()
+        try:
+            for future in as_completed(futures):
+                reducer.add(future.result())
+                now = time.monotonic()
+                if reducer.paths == reducer.total_paths or (
+                    now - emitted_at >= self.summary_interval
+                ):
+                    emitted_at = now
+                    yield reducer.summary()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    async def stream(self, *args, **kwargs):
+        """Async version of `run` for use from request handlers
+
+        Merging and percentile extraction run in the default executor so
+        they never block the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        reducer, futures = self.submit(*args, **kwargs)
+        pending = {asyncio.wrap_future(future) for future in futures}
+        emitted_at = loop.time()
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                results = [future.result() for future in done]
+                await loop.run_in_executor(None, reducer.add, *results)
+                if pending and loop.time() - emitted_at < self.summary_interval:
+                    continue
+                emitted_at = loop.time()
+                yield await loop.run_in_executor(None, reducer.summary)
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the Monte Carlo engine")
+    parser.add_argument("--paths", type=int, default=10_000)
+    parser.add_argument("--steps", type=int, default=90)
+    parser.add_argument("--warehouses", type=int, default=5)
+    parser.add_argument("--items", type=int, default=9)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    initial_stock = rng.integers(50, 500, (args.warehouses, args.items))
+    daily_demand = rng.uniform(5, 20, (args.warehouses, args.items))
+
+    engine = MonteCarloEngine(max_workers=args.workers)
+    start = time.perf_counter()
+    for summary in engine.run(
+        initial_stock,
+        daily_demand,
+        supply_multipliers=[0.7, 0.8],
+        probabilities=[0.5, 0.3],
+        n_paths=args.paths,
+        steps=args.steps,
+        seed=args.seed,
+    ):
+        print(
+            f"{summary['paths']:>7}/{summary['total_paths']} paths "
+            f"{time.perf_counter() - start:7.2f} s  "
+            f"mean stockout probability {summary['stockout_probability'].mean():.3f}"
+        )
+    engine.shutdown()
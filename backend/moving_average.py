@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+
+class MovingAverageIndex:
+    """Moving average of the last `window_size` observations per encoded item
+
+    Each item owns one row of a ring buffer plus a running sum, so adding an
+    observation is O(1) and the current averages are a flat array indexed by
+    the item's label-encoded id.
+    """
+
+    def __init__(self, n_items, window_size):
+        self.window_size = window_size
+        self.buffer = np.zeros((n_items, window_size), dtype=np.float64)
+        self.counts = np.zeros(n_items, dtype=np.int64)
+        self.positions = np.zeros(n_items, dtype=np.int64)
+        self.sums = np.zeros(n_items, dtype=np.float64)
+        self.means = np.full(n_items, np.nan)
+
+    @classmethod
+    def from_observations(cls, item_codes, values, n_items, window_size):
+        """Build the index from ordered observations in a single groupby pass"""
+        index = cls(n_items, window_size)
+        frame = pd.DataFrame(
+            {
+                "code": np.asarray(item_codes, dtype=np.int64),
+                "value": np.asarray(values, dtype=np.float64),
+            }
+        )
+        grouped = frame.groupby("code", sort=False)
+        tail = frame.loc[grouped.tail(window_size).index]
+        slots = tail.groupby("code", sort=False).cumcount().to_numpy()
+        codes = tail["code"].to_numpy()
+        tail_values = tail["value"].to_numpy()
+
+        index.buffer[codes, slots] = tail_values
+        index.counts = np.bincount(codes, minlength=n_items).astype(np.int64)
+        index.positions = index.counts % window_size
+        index.sums = np.bincount(codes, weights=tail_values, minlength=n_items)
+        seen = index.counts > 0
+        index.means[seen] = index.sums[seen] / index.counts[seen]
+        return index
+
+    def copy(self):
+        """Writable copy, e.g. of an index loaded from a memory-mapped artifact"""
+        index = MovingAverageIndex(0, self.window_size)
+        index.buffer = np.array(self.buffer)
+        index.counts = np.array(self.counts)
+        index.positions = np.array(self.positions)
+        index.sums = np.array(self.sums)
+        index.means = np.array(self.means)
+        return index
+
+    def __len__(self):
+        return len(self.means)
+
+    def grow(self, n_items):
+        """Make room for newly encoded items"""
+        extra = n_items - len(self)
+        if extra <= 0:
+            return
+        self.buffer = np.vstack(
+            [self.buffer, np.zeros((extra, self.window_size), dtype=np.float64)]
+        )
+        self.counts = np.concatenate([self.counts, np.zeros(extra, dtype=np.int64)])
+        self.positions = np.concatenate(
+            [self.positions, np.zeros(extra, dtype=np.int64)]
+        )
+        self.sums = np.concatenate([self.sums, np.zeros(extra, dtype=np.float64)])
+        self.means = np.concatenate([self.means, np.full(extra, np.nan)])
+
+    def update(self, code, value):
+        """Add one observation for an item in O(1)"""
+        pos = self.positions[code]
+        if self.counts[code] == self.window_size:
+            self.sums[code] -= self.buffer[code, pos]
+        else:
+            self.counts[code] += 1
+
+        self.buffer[code, pos] = value
+        self.sums[code] += value
+        self.positions[code] = (pos + 1) % self.window_size
+        self.means[code] = self.sums[code] / self.counts[code]
+
+    def update_many(self, codes, values):
+        """Add ordered observations, growing the index for unseen codes"""
+        codes = np.asarray(codes, dtype=np.int64)
+        if len(codes):
+            self.grow(int(codes.max()) + 1)
+        for code, value in zip(codes.tolist(), np.asarray(values, dtype=float).tolist()):
+            self.update(code, value)
+
+    def gather(self, codes):
+        """Current moving averages for encoded items; NaN where none observed"""
+        codes = np.asarray(codes, dtype=np.int64)
+        result = np.full(len(codes), np.nan)
+        known = codes < len(self.means)
+        result[known] = self.means[codes[known]]
+        return result
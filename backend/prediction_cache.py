@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionCache:
+    """Bounded LRU/TTL cache of predictions keyed on encoded feature rows
+
+    Entries are tagged with the model generation they were computed for;
+    a generation change drops every entry.
+    """
+
+    def __init__(self, maxsize=10_000, ttl=None, price_bucket=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.price_bucket = price_bucket
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bucket_prices(self, prices):
+        """Snap prices to the bucket grid so nearby prices share an entry"""
+        prices = np.asarray(prices, dtype=np.float64)
+        if not self.price_bucket:
+            return prices
+        return np.round(prices / self.price_bucket) * self.price_bucket
+
+    def sync(self, generation):
+        """Drop all entries if the model has been retrained since they were cached"""
+        with self._lock:
+            if generation != self.generation:
+                self._entries.clear()
+                self.generation = generation
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_many(self, keys, width=None):
+        """Look up keys; return values (NaN on miss) and the miss mask
+
+        With `width`, each entry holds a row of that many values and the
+        result has shape (len(keys), width).
+        """
+        values = np.full(len(keys) if width is None else (len(keys), width), np.nan)
+        missing = np.ones(len(keys), dtype=bool)
+        now = time.monotonic()
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                value, expires_at = entry
+                if expires_at is not None and expires_at <= now:
+                    del self._entries[key]
+                    self.evictions += 1
+                    continue
+                self._entries.move_to_end(key)
+                values[i] = value
+                missing[i] = False
+
+            n_missing = int(missing.sum())
+            self.misses += n_missing
+            self.hits += len(keys) - n_missing
+
+        return values, missing
+
+    def put_many(self, keys, values):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            for key, value in zip(keys, values):
+                value = float(value) if np.ndim(value) == 0 else tuple(map(float, value))
+                self._entries[key] = (value, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "generation": self.generation,
+            }
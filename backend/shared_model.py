@@ -0,0 +1,232 @@
+import fcntl
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from fast_forest import FlatForest
+from model import StockPredictor
+from prediction_cache import PredictionCache
+
+SHARED_MODEL_DIR = os.environ.get(
+    "SHARED_MODEL_DIR",
+    os.path.join(
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+        "supplychain-model",
+    ),
+)
+
+# Older generations kept around for workers that have not refreshed yet
+KEEP_GENERATIONS = 2
+
+
+def read_generation(directory=SHARED_MODEL_DIR):
+    """Currently published generation, or 0 if nothing has been published"""
+    try:
+        with open(os.path.join(directory, "CURRENT")) as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def publish(predictor, directory=SHARED_MODEL_DIR):
+    """Write a fitted StockPredictor's arrays as a new shared generation
+
+    Each array is a standalone .npy file that workers memory-map read-only,
+    so the OS page cache holds one copy no matter how many workers attach.
+    The CURRENT file is swapped atomically after all arrays are written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    generation = read_generation(directory) + 1
+    generation_dir = os.path.join(directory, f"gen-{generation:08d}")
+    os.makedirs(generation_dir, exist_ok=True)
+
+    arrays = {
+        **{f"forest_{k}": v for k, v in predictor.engine.arrays().items()},
+        "scaler_min": predictor.scaler.min_,
+        "scaler_scale": predictor.scaler.scale_,
+        "item_classes": np.asarray(predictor.le_item.classes_, dtype=str),
+        "trend_classes": np.asarray(predictor.le_trend.classes_, dtype=str),
+        "ma_means": predictor.item_mas.means,
+        "rf_weight": np.asarray(predictor.rf_weight, dtype=np.float64),
+        "target_stats": np.asarray(
+            [predictor.target_mean, predictor.target_std], dtype=np.float64
+        ),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(generation_dir, f"{name}.npy"), np.asarray(array))
+
+    tmp_path = os.path.join(directory, f"CURRENT.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(str(generation))
+    os.replace(tmp_path, os.path.join(directory, "CURRENT"))
+
+    # Unlinking is safe: workers still mapping an old generation keep its pages
+    for old in sorted(os.listdir(directory)):
+        if old.startswith("gen-") and int(old[4:]) <= generation - KEEP_GENERATIONS:
+            shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+
+    return generation
+
+
+def ensure_published(load_predictor, directory=SHARED_MODEL_DIR):
+    """Publish `load_predictor()` unless a generation exists; return the current one
+
+    Workers starting together serialize on a lock file, so only the first
+    loads or trains a model; the others find its generation and never hold
+    a private copy.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "publish.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        generation = read_generation(directory)
+        if generation == 0:
+            generation = publish(load_predictor(), directory)
+    return generation
+
+
+def update_and_publish(predictor, new_data, directory=SHARED_MODEL_DIR, **kwargs):
+    """partial_fit `predictor` on new rows and publish the result to the workers"""
+    predictor.partial_fit(new_data, **kwargs)
+    return publish(predictor, directory)
+
+
+class ArrayLabelEncoder:
+    """Read-only stand-in for a fitted LabelEncoder over a classes array"""
+
+    def __init__(self, classes):
+        self.classes_ = classes
+        self._codes = {label: i for i, label in enumerate(classes.tolist())}
+
+    def transform(self, values):
+        try:
+            return np.fromiter(
+                (self._codes[v] for v in values), dtype=np.int64, count=len(values)
+            )
+        except KeyError as e:
+            raise ValueError(f"y contains previously unseen labels: {e}")
+
+
+class ArrayScaler:
+    """Read-only stand-in for a fitted MinMaxScaler"""
+
+    def __init__(self, min_, scale_):
+        self.min_ = min_
+        self.scale_ = scale_
+
+    def transform(self, X):
+        X = np.array(X, dtype=np.float64)
+        X *= self.scale_
+        X += self.min_
+        return X
+
+
+class ArrayMovingAverages:
+    """Read-only stand-in for MovingAverageIndex over its current means"""
+
+    def __init__(self, means):
+        self.means = means
+
+    def gather(self, codes):
+        codes = np.asarray(codes, dtype=np.int64)
+        result = np.full(len(codes), np.nan)
+        known = codes < len(self.means)
+        result[known] = self.means[codes[known]]
+        return result
+
+
+class SharedStockPredictor(StockPredictor):
+    """StockPredictor inference over a published, memory-mapped generation
+
+    Checks the generation counter at most every `check_interval` seconds and
+    remaps when a newer model has been published, so workers pick up
+    retrained models without restarting.
+    """
+
+    def __init__(self, directory=SHARED_MODEL_DIR, check_interval=1.0, cache=None):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.cache = cache if cache is not None else PredictionCache()
+        self.generation = None
+        self._checked_at = 0.0
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        """Attach to the latest published generation if it changed"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+
+        generation = read_generation(self.directory)
+        if generation == 0:
+            raise FileNotFoundError(f"No model published in {self.directory}")
+        if generation == self.generation:
+            return False
+
+        generation_dir = os.path.join(self.directory, f"gen-{generation:08d}")
+        arrays = {
+            name[: -len(".npy")]: np.load(
+                os.path.join(generation_dir, name), mmap_mode="r"
+            )
+            for name in os.listdir(generation_dir)
+            if name.endswith(".npy")
+        }
+
+        self.engine = FlatForest.from_arrays(
+            {k[len("forest_") :]: v for k, v in arrays.items() if k.startswith("forest_")}
+        )
+        self.scaler = ArrayScaler(arrays["scaler_min"], arrays["scaler_scale"])
+        self.le_item = ArrayLabelEncoder(arrays["item_classes"])
+        self.le_trend = ArrayLabelEncoder(arrays["trend_classes"])
+        self.item_mas = ArrayMovingAverages(arrays["ma_means"])
+        self.rf_weight = float(arrays["rf_weight"])
+        self.target_mean, self.target_std = arrays["target_stats"].tolist()
+        self.generation = generation
+        return True
+
+    def forest_predictions(self, scaled_input):
+        # Only the flattened forest is published
+        return self.engine.predict(scaled_input)
+
+    def predict(self, items, buy_prices, months, market_trends):
+        self.refresh()
+        return super().predict(items, buy_prices, months, market_trends)
+
+    def predict_with_confidence(self, items, buy_prices, months, market_trends):
+        self.refresh()
+        return super().predict_with_confidence(items, buy_prices, months, market_trends)
+
+    def predict_distribution(
+        self, items, buy_prices, months, market_trends, quantiles=(0.1, 0.9)
+    ):
+        self.refresh()
+        return super().predict_distribution(
+            items, buy_prices, months, market_trends, quantiles
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Publish the model to the workers")
+    parser.add_argument("--update", default=None, help="CSV of new rows to partial_fit")
+    parser.add_argument("--new-trees", type=int, default=10)
+    parser.add_argument("--max-trees", type=int, default=None)
+    args = parser.parse_args()
+
+    predictor = StockPredictor()
+    if args.update:
+        generation = update_and_publish(
+            predictor,
+            pd.read_csv(args.update),
+            n_new_trees=args.new_trees,
+            max_trees=args.max_trees,
+        )
+    else:
+        generation = publish(predictor)
+    print(f"Published model generation {generation} to {SHARED_MODEL_DIR}")
@@ -0,0 +1,246 @@
+import asyncio
+import copy
+import itertools
+import time
+import uuid
+
+
+def _set_path(doc, path, value):
+    """Set a dotted change-stream path such as metrics.utilization"""
+    *parents, last = path.split(".")
+    for key in parents:
+        doc = doc[int(key)] if isinstance(doc, list) else doc.setdefault(key, {})
+    if isinstance(doc, list):
+        doc[int(last)] = value
+    else:
+        doc[last] = value
+
+
+class WarehouseStateCache:
+    """In-process warehouse state for the simulation hot path
+
+    Entries hold the warehouse document, its metrics and a precomputed total
+    stock. Reads never touch the database once an entry is loaded; metric
+    changes update the entry and are written through to MongoDB via the
+    write-behind buffer. Other processes' writes arrive through
+    `apply_change` (change stream) or `invalidate`.
+
+    Every write carries a unique `write_id` ("<origin>:<seq>"), so a change
+    event can be attributed to the write that caused it rather than to
+    whoever wrote the document last. Fields with own writes not yet seen
+    in the change stream are pending; other writers' changes to them are
+    not applied, as the buffered write will supersede them.
+    """
+
+    def __init__(self, collection, write_buffer, origin=None):
+        self.collection = collection
+        self.write_buffer = write_buffer
+        self.origin = origin or uuid.uuid4().hex
+        self._entries = {}
+        self._ids_by_object_id = {}
+        # warehouse id -> {field: seq of the latest own write to it}
+        self._pending = {}
+        self._seq = itertools.count(1)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _entry(doc):
+        return {
+            "doc": doc,
+            "metrics": doc.get("metrics", {}),
+            "total_stock": sum(item["stock"] for item in doc.get("inventory", [])),
+        }
+
+    async def load(self):
+        """Populate the cache from the collection, e.g. at startup"""
+        async for doc in self.collection.find({}):
+            self.apply(doc)
+        return len(self._entries)
+
+    def apply(self, doc):
+        """Replace an entry with a fresh copy of the document
+
+        Fields with pending own writes keep their cached values.
+        """
+        if "_id" in doc:
+            self._ids_by_object_id[doc["_id"]] = doc["id"]
+        pending = self._pending.get(doc["id"])
+        current = self._entries.get(doc["id"])
+        if pending and current is not None:
+            kept = {f: current["doc"][f] for f in pending if f in current["doc"]}
+            doc = {**doc, **kept}
+        self._entries[doc["id"]] = self._entry(doc)
+
+    def apply_change(self, change):
+        """Fold one change-stream event into the cache"""
+        operation = change.get("operationType")
+        if operation == "delete":
+            self.invalidate_object_id(change["documentKey"]["_id"])
+            return
+
+        doc = change.get("fullDocument")
+        if operation != "update":
+            if doc is not None:
+                self.apply(doc)
+            return
+
+        updated = change["updateDescription"]["updatedFields"]
+        origin, _, seq = str(updated.get("write_id", "")).partition(":")
+        warehouse_id = self._ids_by_object_id.get(change["documentKey"]["_id"])
+        if warehouse_id is None and doc is not None:
+            warehouse_id = doc["id"]
+        if origin == self.origin:
+            # Our own write reached the database; its fields are settled
+            self._acknowledge(warehouse_id, int(seq))
+            return
+
+        entry = self._entries.get(warehouse_id)
+        if entry is None:
+            if doc is not None:
+                self.apply(doc)
+            return
+        pending = self._pending.get(warehouse_id, {})
+        # Deep copied: nested values may be shared with queued writes
+        changed = copy.deepcopy(entry["doc"])
+        for path, value in updated.items():
+            if path.split(".")[0] not in pending:
+                _set_path(changed, path, value)
+        self._entries[warehouse_id] = self._entry(changed)
+
+    def _acknowledge(self, warehouse_id, seq):
+        pending = self._pending.get(warehouse_id)
+        if not pending:
+            return
+        for field in [f for f, s in pending.items() if s <= seq]:
+            del pending[field]
+        if not pending:
+            del self._pending[warehouse_id]
+
+    def invalidate(self, warehouse_id):
+        self._entries.pop(warehouse_id, None)
+
+    def invalidate_object_id(self, object_id):
+        """Drop the entry for a deleted document, known only by its _id"""
+        warehouse_id = self._ids_by_object_id.pop(object_id, None)
+        if warehouse_id is not None:
+            self.invalidate(warehouse_id)
+
+    def ids(self):
+        return list(self._entries)
+
+    async def get(self, warehouse_id):
+        """Cached state; only a miss reads from the database"""
+        entry = self._entries.get(warehouse_id)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        doc = await self.collection.find_one({"id": warehouse_id})
+        if doc is None:
+            return None
+        self.apply(doc)
+        return self._entries[warehouse_id]
+
+    async def update_metrics(self, warehouse_id, metrics):
+        entry = self._entries[warehouse_id]
+        entry["metrics"] = metrics
+        entry["doc"]["metrics"] = metrics
+        seq = next(self._seq)
+        self._pending.setdefault(warehouse_id, {})["metrics"] = seq
+        await self.write_buffer.update(
+            self.collection,
+            {"id": warehouse_id},
+            {"$set": {"metrics": metrics, "write_id": f"{self.origin}:{seq}"}},
+        )
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending": sum(len(p) for p in self._pending.values()),
+        }
+
+
+class LatestStateCache:
+    """Latest simulation state per warehouse; the newest timestamp wins
+
+    A miss falls back to one index-backed query on (warehouse_id,
+    timestamp), so polling every warehouse never scans the collection.
+    Entries are revalidated the same way once they are `ttl` seconds old,
+    so states saved by other workers show up within that delay.
+    """
+
+    def __init__(self, collection, ttl=1.0):
+        self.collection = collection
+        self.ttl = ttl
+        self._latest = {}
+        self._checked_at = {}
+        self.hits = 0
+        self.misses = 0
+
+    def offer(self, state):
+        """Keep `state` if it is at least as new as the cached one"""
+        current = self._latest.get(state["warehouse_id"])
+        if current is not None and state["timestamp"] < current["timestamp"]:
+            return False
+        self._latest[state["warehouse_id"]] = state
+        return True
+
+    async def get(self, warehouse_id):
+        state = self._latest.get(warehouse_id)
+        checked_at = self._checked_at.get(warehouse_id, float("-inf"))
+        if state is not None and time.monotonic() - checked_at < self.ttl:
+            self.hits += 1
+            return state
+
+        self.misses += 1
+        self._checked_at[warehouse_id] = time.monotonic()
+        doc = await self.collection.find_one(
+            {"warehouse_id": warehouse_id}, sort=[("timestamp", -1)]
+        )
+        if doc is not None:
+            # A newer state may have been offered while the query was running
+            self.offer(doc)
+        return self._latest.get(warehouse_id)
+
+    def stats(self):
+        return {"size": len(self._latest), "hits": self.hits, "misses": self.misses}
+
+
+class ChangeStreamListener:
+    """Feeds other workers' warehouse writes into a cache via a change stream
+
+    Change streams need a replica set; on a standalone server the listener
+    logs the error and stops, leaving the cache to its own writes.
+    """
+
+    def __init__(self, collection, cache):
+        self.collection = collection
+        self.cache = cache
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        try:
+            async with self.collection.watch(full_document="updateLookup") as stream:
+                async for change in stream:
+                    self.cache.apply_change(change)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Warehouse change stream stopped: {e}")
@@ -0,0 +1,540 @@
+import abc
+import copy
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import (
+    DeleteMany,
+    DeleteOne,
+    InsertOne,
+    UpdateMany,
+    UpdateOne,
+    WriteConcern,
+)
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import (
+    BulkWriteResult,
+    DeleteResult,
+    InsertManyResult,
+    InsertOneResult,
+    UpdateResult,
+)
+
+COLLECTION_NAMES = {
+    "warehouses": "warehouses",
+    "simulations": "simulations",
+    "predictions": "predictions",
+    "events": "events",
+    "sentiment": "sentiment",
+}
+INDEX_OPTIONS_CONFLICT = 85
+
+
+class Storage(abc.ABC):
+    """The app's stores, each exposing the motor collection API it uses"""
+
+    @abc.abstractmethod
+    def collection(self, name):
+        """The named collection"""
+
+    @property
+    def warehouses(self):
+        return self.collection(COLLECTION_NAMES["warehouses"])
+
+    @property
+    def simulations(self):
+        return self.collection(COLLECTION_NAMES["simulations"])
+
+    @property
+    def predictions(self):
+        return self.collection(COLLECTION_NAMES["predictions"])
+
+    @property
+    def events(self):
+        return self.collection(COLLECTION_NAMES["events"])
+
+    @property
+    def sentiment(self):
+        return self.collection(COLLECTION_NAMES["sentiment"])
+
+    def close(self):
+        pass
+
+
+class MotorStorage(Storage):
+    """MongoDB through motor, with explicit pool, timeout and write-concern settings"""
+
+    def __init__(
+        self,
+        url="mongodb://localhost:27017",
+        database="SupplyChain",
+        max_pool_size=100,
+        min_pool_size=0,
+        server_selection_timeout_ms=30_000,
+        connect_timeout_ms=20_000,
+        socket_timeout_ms=None,
+        write_concern="1",
+        journal=None,
+    ):
+        self.client = AsyncIOMotorClient(
+            url,
+            maxPoolSize=max_pool_size,
+            minPoolSize=min_pool_size,
+            serverSelectionTimeoutMS=server_selection_timeout_ms,
+            connectTimeoutMS=connect_timeout_ms,
+            socketTimeoutMS=socket_timeout_ms,
+            # Timestamps are written as aware UTC; read them back the same way
+            tz_aware=True,
+        )
+        w = int(write_concern) if str(write_concern).isdigit() else write_concern
+        self.db = self.client.get_database(
+            database, write_concern=WriteConcern(w=w, j=journal)
+        )
+
+    @classmethod
+    def from_env(cls):
+        socket_timeout = os.environ.get("MONGO_SOCKET_TIMEOUT_MS")
+        journal = os.environ.get("MONGO_JOURNAL")
+        return cls(
+            url=os.environ.get("MONGO_URL", "mongodb://localhost:27017"),
+            database=os.environ.get("MONGO_DATABASE", "SupplyChain"),
+            max_pool_size=int(os.environ.get("MONGO_MAX_POOL_SIZE", "100")),
+            min_pool_size=int(os.environ.get("MONGO_MIN_POOL_SIZE", "0")),
+            server_selection_timeout_ms=int(
+                os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000")
+            ),
+            connect_timeout_ms=int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "20000")),
+            socket_timeout_ms=int(socket_timeout) if socket_timeout else None,
+            write_concern=os.environ.get("MONGO_WRITE_CONCERN", "1"),
+            journal=journal == "1" if journal is not None else None,
+        )
+
+    def collection(self, name):
+        return self.db[name]
+
+    def close(self):
+        self.client.close()
+
+
+def _get(doc, path):
+    for key in path.split("."):
+        if not isinstance(doc, dict) or key not in doc:
+            return None
+        doc = doc[key]
+    return doc
+
+
+def _has(doc, path):
+    for key in path.split("."):
+        if not isinstance(doc, dict) or key not in doc:
+            return False
+        doc = doc[key]
+    return True
+
+
+def _as_utc(value):
+    """MongoDB stores datetimes as UTC, so naive ones are taken to be UTC"""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def _compare(value, op, target):
+    if op == "$eq":
+        return value == target
+    if op == "$ne":
+        return value != target
+    if op == "$in":
+        return value in target
+    if op == "$nin":
+        return value not in target
+    if value is None:
+        return False
+    if op == "$gt":
+        return value > target
+    if op == "$gte":
+        return value >= target
+    if op == "$lt":
+        return value < target
+    if op == "$lte":
+        return value <= target
+    raise OperationFailure(f"Unsupported query operator {op}")
+
+
+def _matches(doc, query):
+    for path, condition in query.items():
+        if isinstance(condition, dict) and condition and all(
+            k.startswith("$") for k in condition
+        ):
+            value = _get(doc, path)
+            for op, target in condition.items():
+                if op == "$exists":
+                    if _has(doc, path) != bool(target):
+                        return False
+                elif not _compare(value, op, target):
+                    return False
+        elif _get(doc, path) != condition:
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if fields and all(fields.values()):
+        result = {k: copy.deepcopy(doc[k]) for k in fields if k in doc}
+    else:
+        result = {k: copy.deepcopy(v) for k, v in doc.items() if k not in fields}
+    if include_id and "_id" in doc:
+        result["_id"] = doc["_id"]
+    elif not include_id:
+        result.pop("_id", None)
+    return result
+
+
+def _normalize_keys(keys, direction=None):
+    if isinstance(keys, str):
+        return [(keys, direction if direction is not None else 1)]
+    return list(keys)
+
+
+class InMemoryCursor:
+    """Lazily evaluated find() result supporting sort, skip and limit"""
+
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query or {}
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, keys, direction=None):
+        self._sort = _normalize_keys(keys, direction)
+        return self
+
+    def skip(self, n):
+        self._skip = n
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def _documents(self):
+        docs = self._collection._find(self._query)
+        # Stable sorts applied from the last key to the first
+        for field, direction in reversed(self._sort):
+            present = [d for d in docs if _get(d, field) is not None]
+            missing = [d for d in docs if _get(d, field) is None]
+            present.sort(key=lambda d: _get(d, field), reverse=direction < 0)
+            docs = missing + present if direction > 0 else present + missing
+        docs = docs[self._skip :]
+        if self._limit:
+            docs = docs[: self._limit]
+        return [_project(d, self._projection) for d in docs]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._documents():
+            yield doc
+
+    async def to_list(self, length=None):
+        docs = self._documents()
+        return docs if length is None else docs[:length]
+
+
+class InMemoryDatabase:
+    def __init__(self, name="SupplyChain"):
+        self.name = name
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = InMemoryCollection(name, self)
+        return self._collections[name]
+
+    async def command(self, command):
+        if "collMod" not in command:
+            raise OperationFailure(f"Unsupported command {list(command)[0]}")
+        collection = self[command["collMod"]]
+        spec = command.get("index", {})
+        keys = list(spec.get("keyPattern", {}).items())
+        for index in collection._indexes.values():
+            if index["keys"] == keys:
+                if "expireAfterSeconds" in spec:
+                    index["expireAfterSeconds"] = spec["expireAfterSeconds"]
+                return {"ok": 1.0}
+        raise OperationFailure("cannot find index", code=27)
+
+
+class InMemoryCollection:
+    """A dict-backed stand-in for the motor collection API the app uses
+
+    Supports equality and comparison queries, projections, sorting, unique
+    and TTL indexes, $set/$setOnInsert/$unset/$inc updates with upserts and
+    bulk writes. Documents are copied on the way in and out, as they would
+    be by a real server. Change streams are not supported.
+    """
+
+    def __init__(self, name, database):
+        self.name = name
+        self.database = database
+        self._docs = {}
+        self._indexes = {"_id_": {"keys": [("_id", 1)], "unique": True}}
+        self._last_expiry = 0.0
+
+    def _expire(self):
+        now = time.monotonic()
+        if now - self._last_expiry < 1.0:
+            return
+        self._last_expiry = now
+        for index in self._indexes.values():
+            ttl = index.get("expireAfterSeconds")
+            if ttl is None:
+                continue
+            field = index["keys"][0][0]
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=ttl)
+            expired = [
+                _id
+                for _id, doc in self._docs.items()
+                if isinstance(doc.get(field), datetime) and _as_utc(doc[field]) < cutoff
+            ]
+            for _id in expired:
+                del self._docs[_id]
+
+    def _find(self, query):
+        self._expire()
+        return [doc for doc in self._docs.values() if _matches(doc, query)]
+
+    def _check_unique(self, doc, ignore_id=None):
+        for name, index in self._indexes.items():
+            if not index.get("unique") or name == "_id_":
+                continue
+            partial = index.get("partialFilterExpression")
+            if partial is not None and not _matches(doc, partial):
+                continue
+            key = tuple(_get(doc, field) for field, _ in index["keys"])
+            for other in self._docs.values():
+                if other["_id"] == ignore_id:
+                    continue
+                if partial is not None and not _matches(other, partial):
+                    continue
+                if tuple(_get(other, field) for field, _ in index["keys"]) == key:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.name} "
+                        f"index: {name}",
+                        code=11000,
+                    )
+
+    def _insert(self, document):
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        if document["_id"] in self._docs:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.name} index: _id_",
+                code=11000,
+            )
+        doc = copy.deepcopy(document)
+        self._check_unique(doc)
+        self._docs[doc["_id"]] = doc
+        return doc["_id"]
+
+    @staticmethod
+    def _apply_update(doc, update, inserting):
+        for op, fields in update.items():
+            if op == "$setOnInsert" and not inserting:
+                continue
+            for path, value in fields.items():
+                *parents, last = path.split(".")
+                target = doc
+                for key in parents:
+                    target = target.setdefault(key, {})
+                if op in ("$set", "$setOnInsert"):
+                    target[last] = copy.deepcopy(value)
+                elif op == "$unset":
+                    target.pop(last, None)
+                elif op == "$inc":
+                    target[last] = target.get(last, 0) + value
+                else:
+                    raise OperationFailure(f"Unsupported update operator {op}")
+
+    def _update(self, filter, update, upsert=False, multi=False):
+        matched = self._find(filter)
+        if not multi:
+            matched = matched[:1]
+        for doc in matched:
+            updated = copy.deepcopy(doc)
+            self._apply_update(updated, update, inserting=False)
+            self._check_unique(updated, ignore_id=doc["_id"])
+            self._docs[doc["_id"]] = updated
+        if matched or not upsert:
+            return {"n": len(matched), "nModified": len(matched), "upserted": None}
+
+        doc = {
+            k: v
+            for k, v in filter.items()
+            if not k.startswith("$") and not isinstance(v, dict)
+        }
+        self._apply_update(doc, update, inserting=True)
+        return {"n": 1, "nModified": 0, "upserted": self._insert(doc)}
+
+    def _delete(self, filter, multi=True):
+        matched = self._find(filter)
+        if not multi:
+            matched = matched[:1]
+        for doc in matched:
+            del self._docs[doc["_id"]]
+        return len(matched)
+
+    def find(self, filter=None, projection=None, **kwargs):
+        cursor = InMemoryCursor(self, filter, projection)
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        if kwargs.get("limit"):
+            cursor.limit(kwargs["limit"])
+        return cursor
+
+    async def find_one(self, filter=None, projection=None, sort=None):
+        cursor = self.find(filter, projection, sort=sort).limit(1)
+        docs = await cursor.to_list()
+        return docs[0] if docs else None
+
+    async def count_documents(self, filter):
+        return len(self._find(filter))
+
+    async def insert_one(self, document):
+        return InsertOneResult(self._insert(document), True)
+
+    async def insert_many(self, documents, ordered=True):
+        return InsertManyResult([self._insert(d) for d in documents], True)
+
+    async def update_one(self, filter, update, upsert=False):
+        return UpdateResult(self._update(filter, update, upsert), True)
+
+    async def update_many(self, filter, update, upsert=False):
+        return UpdateResult(self._update(filter, update, upsert, multi=True), True)
+
+    async def delete_one(self, filter):
+        return DeleteResult({"n": self._delete(filter, multi=False)}, True)
+
+    async def delete_many(self, filter):
+        return DeleteResult({"n": self._delete(filter)}, True)
+
+    async def bulk_write(self, requests, ordered=True):
+        result = {
+            "writeErrors": [],
+            "nInserted": 0,
+            "nUpserted": 0,
+            "nMatched": 0,
+            "nModified": 0,
+            "nRemoved": 0,
+            "upserted": [],
+        }
+        for i, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    result["nInserted"] += 1
+                elif isinstance(request, (UpdateOne, UpdateMany)):
+                    outcome = self._update(
+                        request._filter,
+                        request._doc,
+                        request._upsert,
+                        multi=isinstance(request, UpdateMany),
+                    )
+                    if outcome["upserted"] is not None:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": i, "_id": outcome["upserted"]})
+                    else:
+                        result["nMatched"] += outcome["n"]
+                        result["nModified"] += outcome["nModified"]
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    result["nRemoved"] += self._delete(
+                        request._filter, multi=isinstance(request, DeleteMany)
+                    )
+                else:
+                    raise OperationFailure(f"Unsupported bulk operation {request!r}")
+            except (DuplicateKeyError, OperationFailure) as e:
+                result["writeErrors"].append(
+                    {"index": i, "code": e.code, "errmsg": str(e), "op": request}
+                )
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    async def create_index(
+        self,
+        keys,
+        unique=False,
+        expireAfterSeconds=None,
+        partialFilterExpression=None,
+        **kwargs,
+    ):
+        keys = _normalize_keys(keys)
+        name = kwargs.get("name") or "_".join(f"{k}_{d}" for k, d in keys)
+        options = {"keys": keys, "unique": unique}
+        if expireAfterSeconds is not None:
+            options["expireAfterSeconds"] = expireAfterSeconds
+        if partialFilterExpression is not None:
+            options["partialFilterExpression"] = partialFilterExpression
+
+        existing = self._indexes.get(name)
+        if existing is not None:
+            if existing != options:
+                raise OperationFailure(
+                    f"An existing index has the same name as the requested "
+                    f"index but different options: {name}",
+                    code=INDEX_OPTIONS_CONFLICT,
+                )
+            return name
+        if unique:
+            seen = set()
+            for doc in self._docs.values():
+                if partialFilterExpression is not None and not _matches(
+                    doc, partialFilterExpression
+                ):
+                    continue
+                key = tuple(_get(doc, field) for field, _ in keys)
+                if key in seen:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.name} "
+                        f"index: {name}",
+                        code=11000,
+                    )
+                seen.add(key)
+        self._indexes[name] = options
+        return name
+
+    async def index_information(self):
+        return copy.deepcopy(self._indexes)
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("Change streams are not supported by in-memory storage")
+
+
+class InMemoryStorage(Storage):
+    """Process-local storage for tests, load tests and benchmarks"""
+
+    def __init__(self, database="SupplyChain"):
+        self.db = InMemoryDatabase(database)
+
+    def collection(self, name):
+        return self.db[name]
+
+
+def open_storage(backend=None):
+    """Storage selected by `backend` or STORAGE_BACKEND ("mongo" or "memory")"""
+    backend = backend or os.environ.get("STORAGE_BACKEND", "mongo")
+    if backend == "memory":
+        return InMemoryStorage(os.environ.get("MONGO_DATABASE", "SupplyChain"))
+    if backend == "mongo":
+        return MotorStorage.from_env()
+    raise ValueError(f"Unknown storage backend {backend!r}")
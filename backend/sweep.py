@@ -0,0 +1,212 @@
+import itertools
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import r2_score
+from sklearn.model_selection import train_test_split
+
+from fast_forest import FlatForest
+from moving_average import MovingAverageIndex
+
+DEFAULT_GRID = {
+    "n_estimators": [25, 50, 100],
+    "max_depth": [6, 10, None],
+    "window_size": [5, 10, 20],
+    "rf_weight": [0.5, 0.7, 0.9],
+}
+
+# Arrays attached from shared memory inside each worker
+_shared = {}
+_segments = []
+
+
+def _publish(arrays):
+    """Copy arrays into shared memory once; return the segments and their specs"""
+    segments, specs = [], {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+        segments.append(segment)
+        specs[name] = (segment.name, array.shape, array.dtype.str)
+    return segments, specs
+
+
+def _attach(specs):
+    """Worker initializer: map the published arrays without copying them"""
+    for name, (segment_name, shape, dtype) in specs.items():
+        segment = shared_memory.SharedMemory(name=segment_name)
+        _segments.append(segment)
+        _shared[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+
+
+def _evaluate_forest(n_estimators, max_depth, window_sizes, rf_weights, repeats=20):
+    """Fit one forest and score every MA window / ensemble weight on top of it"""
+    X, y, codes = _shared["X"], _shared["y"], _shared["codes"]
+    train_idx, test_idx = _shared["train_idx"], _shared["test_idx"]
+    n_items = int(codes.max()) + 1
+
+    model = RandomForestRegressor(
+        n_estimators=n_estimators, max_depth=max_depth, random_state=42, n_jobs=1
+    )
+    start = time.perf_counter()
+    model.fit(X[train_idx], y[train_idx])
+    train_time = time.perf_counter() - start
+
+    # Latency is measured on the flattened engine that serving uses
+    engine = FlatForest.from_sklearn(model)
+    X_test = X[test_idx]
+    start = time.perf_counter()
+    rf_predictions = engine.predict(X_test)
+    batch_latency = (time.perf_counter() - start) / len(test_idx)
+
+    single_row = X_test[:1]
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        engine.predict(single_row)
+        timings.append(time.perf_counter() - start)
+
+    model_size = len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+
+    # The MA index only ever sees training rows, in their original order
+    ordered_train = np.sort(train_idx)
+    results = []
+    for window_size in window_sizes:
+        ma_index = MovingAverageIndex.from_observations(
+            codes[ordered_train], y[ordered_train], n_items, window_size
+        )
+        ma_predictions = ma_index.gather(codes[test_idx])
+        ma_predictions = np.where(
+            np.isnan(ma_predictions), rf_predictions, ma_predictions
+        )
+        for rf_weight in rf_weights:
+            predictions = rf_weight * rf_predictions + (1 - rf_weight) * ma_predictions
+            results.append(
+                {
+                    "n_estimators": n_estimators,
+                    "max_depth": max_depth,
+                    "window_size": window_size,
+                    "rf_weight": rf_weight,
+                    "r2": float(r2_score(y[test_idx], predictions)),
+                    "train_time_s": train_time,
+                    "batch_latency_ms_per_row": batch_latency * 1000,
+                    "single_row_latency_ms": float(np.median(timings)) * 1000,
+                    "model_size_bytes": model_size,
+                }
+            )
+    return results
+
+
+def run_sweep(predictor, grid=None, latency_budget_ms=None, max_workers=None):
+    """Evaluate candidate StockPredictor configurations in a process pool
+
+    Returns a dict with one result row per configuration and the best
+    configuration whose single-row latency fits `latency_budget_ms`.
+    """
+    grid = {**DEFAULT_GRID, **(grid or {})}
+
+    # Features are prepared once with the predictor's fitted encoders
+    df = pd.DataFrame(predictor.data)
+    X = predictor.transform_features(df)
+    y = df["Stock in Inventory"].values.astype(np.float64)
+    train_idx, test_idx = train_test_split(
+        np.arange(len(df)), test_size=0.2, random_state=42
+    )
+
+    segments, specs = _publish(
+        {
+            "X": X,
+            "y": y,
+            "codes": df["Item_Encoded"].values.astype(np.int64),
+            "train_idx": train_idx,
+            "test_idx": test_idx,
+        }
+    )
+
+    results = []
+    try:
+        forests = list(itertools.product(grid["n_estimators"], grid["max_depth"]))
+        with ProcessPoolExecutor(
+            max_workers=max_workers or min(len(forests), os.cpu_count() or 1),
+            initializer=_attach,
+            initargs=(specs,),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _evaluate_forest,
+                    n_estimators,
+                    max_depth,
+                    grid["window_size"],
+                    grid["rf_weight"],
+                )
+                for n_estimators, max_depth in forests
+            ]
+            for future in as_completed(futures):
+                results.extend(future.result())
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+    results.sort(key=lambda r: r["r2"], reverse=True)
+    eligible = [
+        r
+        for r in results
+        if latency_budget_ms is None or r["single_row_latency_ms"] <= latency_budget_ms
+    ]
+    if eligible:
+        best = eligible[0]
+    else:
+        best = min(results, key=lambda r: r["single_row_latency_ms"])
+
+    return {"results": results, "best": best, "latency_budget_ms": latency_budget_ms}
+
+
+def print_report(report):
+    """Print a timing report for a sweep"""
+    header = (
+        f"{'trees':>6} {'depth':>6} {'window':>7} {'rf_w':>5} {'r2':>7} "
+        f"{'train_s':>8} {'row_ms':>8} {'single_ms':>10} {'size_kb':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in report["results"]:
+        print(
+            f"{r['n_estimators']:>6} {str(r['max_depth']):>6} {r['window_size']:>7} "
+            f"{r['rf_weight']:>5.2f} {r['r2']:>7.3f} {r['train_time_s']:>8.3f} "
+            f"{r['batch_latency_ms_per_row']:>8.4f} {r['single_row_latency_ms']:>10.3f} "
+            f"{r['model_size_bytes'] / 1024:>9.1f}"
+        )
+
+    best = report["best"]
+    print(
+        f"\nBest under {report['latency_budget_ms']} ms budget: "
+        f"n_estimators={best['n_estimators']}, max_depth={best['max_depth']}, "
+        f"window_size={best['window_size']}, rf_weight={best['rf_weight']} "
+        f"(r2={best['r2']:.3f}, single_row={best['single_row_latency_ms']:.3f} ms)"
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from model import StockPredictor
+
+    parser = argparse.ArgumentParser(description="StockPredictor hyperparameter sweep")
+    parser.add_argument("--latency-budget-ms", type=float, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    report = run_sweep(
+        StockPredictor(),
+        latency_budget_ms=args.latency_budget_ms,
+        max_workers=args.workers,
+    )
+    print_report(report)
@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+from pymongo import InsertOne, UpdateOne
+
+
+class WriteBehindBuffer:
+    """Queues MongoDB writes off the response path and flushes them in bulk
+
+    Writes are grouped per collection and sent with one ordered bulk_write
+    once `flush_size` operations are pending or `flush_interval` seconds
+    have passed. At most `max_pending` operations are held; beyond that,
+    writers wait for a flush, which bounds memory.
+    """
+
+    def __init__(self, max_pending=10_000, flush_size=500, flush_interval=0.25):
+        self.max_pending = max_pending
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.depth = 0
+        self.enqueued = 0
+        self.flushed = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self._pending = {}
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._flush_done = asyncio.Event()
+        self._task = None
+        self._closing = False
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the background flusher and write out everything still queued"""
+        if self._task is not None:
+            # Signalled rather than cancelled so an in-flight bulk write completes
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._closing = False
+        await self.flush()
+
+    async def insert(self, collection, document):
+        await self._add(collection, InsertOne(document))
+
+    async def update(self, collection, filter, update, upsert=False):
+        await self._add(collection, UpdateOne(filter, update, upsert=upsert))
+
+    async def _add(self, collection, operation):
+        while self.depth >= self.max_pending:
+            if self._task is None or self._task.done():
+                await self.flush(min_depth=self.max_pending)
+            else:
+                # Let the background flusher drain the buffer, then retry
+                self._flush_done.clear()
+                self._wakeup.set()
+                await self._flush_done.wait()
+
+        _, operations = self._pending.setdefault(id(collection), (collection, []))
+        operations.append(operation)
+        self.depth += 1
+        self.enqueued += 1
+        if self.depth >= self.flush_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self, min_depth=1):
+        async with self._lock:
+            # Another writer may have flushed while this one waited on the lock
+            if not self._pending or self.depth < min_depth:
+                return
+            pending, self._pending = self._pending, {}
+            self.depth = 0
+
+            start = time.perf_counter()
+            for collection, operations in pending.values():
+                try:
+                    await collection.bulk_write(operations, ordered=True)
+                    self.flushed += len(operations)
+                except Exception as e:
+                    self.failed += len(operations)
+                    print(f"Error flushing {len(operations)} buffered writes: {e}")
+
+            self.last_flush_latency = time.perf_counter() - start
+            self.max_flush_latency = max(self.max_flush_latency, self.last_flush_latency)
+            self.flushes += 1
+            self._flush_done.set()
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "max_pending": self.max_pending,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "last_flush_latency_ms": self.last_flush_latency * 1000,
+            "max_flush_latency_ms": self.max_flush_latency * 1000,
+        }